@@ -0,0 +1,161 @@
+"""
+Benchmark del estandarizador de encabezados por reglas.
+Compara la normalización precompilada de HeaderStandardizerRules contra la
+implementación original (regex sin compilar y replace secuencial) y verifica
+que ambas generen los mismos nombres estándar.
+"""
+#----------------------------
+# LIBRERÍAS
+#----------------------------
+import json
+import logging
+import re
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, List, Optional
+
+from unidecode import unidecode
+
+import os
+from dotenv import load_dotenv
+
+from header_standarizer_ruler import HeaderStandardizerRules, logger as rules_logger
+
+#----------------------------
+# VARIABLES DE ENTORNO
+#----------------------------
+load_dotenv("./variables_local.env")
+
+FOLDER_PROCESSED = os.getenv("FOLDER_PROCESSED", "data/processed/")
+MAPPING_HEADERS_FILE = os.getenv("MAPPING_HEADERS_FILE", f"{FOLDER_PROCESSED}campos_hom_data.json")
+
+#----------------------------
+# CONFIGURACIONES LOGGING
+#----------------------------
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s | %(levelname)s | %(name)s | %(message)s"
+)
+logger = logging.getLogger("Benchmark Encabezados")
+
+
+#----------------------------
+# INICIO CODIGO
+#----------------------------
+
+class _ReferenceRules(HeaderStandardizerRules):
+    """Implementación original, sin patrones precompilados (solo referencia)."""
+
+    def _normalize_text(self, text: str) -> str:
+        text = text.lower()
+        for pattern in self.remove_patterns:
+            text = re.sub(pattern, ' ', text)
+        text = unidecode(text)
+        return ' '.join(text.split())
+
+    def _apply_abbreviations(self, text: str) -> str:
+        for word, abbrev in self.special_abbreviations.items():
+            text = text.replace(word, abbrev)
+        return ' '.join(self.abbreviations.get(word, word) for word in text.split())
+
+    def _extract_measure_unit(self, text: str) -> Optional[str]:
+        match = re.search(r"\(?\b([a-zA-Z]+\d*(?:/[a-zA-Z]+\d*)+)\b\)?", text)
+        if match:
+            return match.group(1).lower().replace('/', '')
+        text_lower = text.lower()
+        for unit in self.measure_units:
+            if re.search(rf'\b{unit}\b', text_lower):
+                return unit
+        return None
+
+
+def load_headers(mappings_file: str = MAPPING_HEADERS_FILE) -> List[str]:
+    """Lee los encabezados originales registrados en el archivo de mapeos."""
+    with open(mappings_file, 'r', encoding='utf-8') as f:
+        mappings = json.load(f)
+    headers = []
+    for info in mappings.values():
+        headers.extend(info.get('original_names', info.get('default', [])))
+    return headers
+
+
+def time_function(func: Callable[[str], str], headers: List[str], repeat: int, rounds: int = 5) -> float:
+    """Mejor tiempo por llamada (us) de aplicar func a todos los encabezados `repeat` veces."""
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for header in headers:
+                func(header)
+        best = min(best, time.perf_counter() - start)
+    return 1e6 * best / (len(headers) * repeat)
+
+
+def benchmark_rules(headers: List[str], repeat: int = 50) -> dict:
+    """
+    Mide ambas implementaciones sobre los mismos encabezados, por etapa y completa.
+
+    Returns:
+        Diccionario con tiempos (us por encabezado), speedup y encabezados con resultado distinto
+    """
+    with tempfile.TemporaryDirectory() as tmpdir:
+        tmpfile = Path(tmpdir) / "mappings.json"
+        reference = _ReferenceRules(mappings_file=tmpfile)
+        compiled = HeaderStandardizerRules(mappings_file=tmpfile)
+
+    level = rules_logger.level
+    rules_logger.setLevel(logging.ERROR)
+    try:
+        mismatches = [
+            h for h in headers
+            if reference._generate_standard_name(h) != compiled._generate_standard_name(h)
+        ]
+        normalized = [compiled._normalize_text(h) for h in headers]
+        stages = {
+            "_normalize_text": headers,
+            "_apply_abbreviations": normalized,
+            "_extract_measure_unit": headers,
+            "_generate_standard_name": headers,
+        }
+        timings = {}
+        for stage, inputs in stages.items():
+            t_reference = time_function(getattr(reference, stage), inputs, repeat)
+            t_compiled = time_function(getattr(compiled, stage), inputs, repeat)
+            timings[stage] = {
+                "reference_us": t_reference,
+                "compiled_us": t_compiled,
+                "speedup": t_reference / t_compiled,
+            }
+    finally:
+        rules_logger.setLevel(level)
+
+    return {
+        "headers": len(headers),
+        "timings": timings,
+        "mismatches": mismatches,
+    }
+
+
+def main():
+    headers = load_headers()
+    result = benchmark_rules(headers)
+
+    print("\n" + "="*80)
+    print("BENCHMARK: ESTANDARIZACIÓN CON REGLAS")
+    print("="*80)
+    print(f"Encabezados: {result['headers']}")
+    print(f"{'Etapa':<26}{'Referencia (us)':>18}{'Precompilado (us)':>20}{'Speedup':>10}")
+    print("-"*80)
+    for stage, t in result['timings'].items():
+        print(f"{stage:<26}{t['reference_us']:>18.1f}{t['compiled_us']:>20.1f}{t['speedup']:>9.2f}x")
+    print(f"\nDiferencias: {len(result['mismatches'])}")
+    for header in result['mismatches']:
+        print(f"  - {header!r}")
+
+    if result['mismatches']:
+        raise AssertionError("La versión precompilada no reproduce los nombres originales")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Benchmark del estandarizador de encabezados con LLM en CPU.
+Compara la inferencia fp32 contra la cuantizada int8 (cuantización dinámica):
+latencia por encabezado y concordancia de los nombres generados.
+"""
+#----------------------------
+# LIBRERÍAS
+#----------------------------
+import argparse
+import logging
+import time
+from typing import List, Optional
+
+from header_standarizer_llm import HeaderStandardizer, logger as llm_logger
+from benchmark_headers import load_headers
+
+#----------------------------
+# CONFIGURACIONES LOGGING
+#----------------------------
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s | %(levelname)s | %(name)s | %(message)s"
+)
+logger = logging.getLogger("Benchmark LLM")
+
+
+#----------------------------
+# INICIO CODIGO
+#----------------------------
+
+def run_standardizer(standardizer: HeaderStandardizer, headers: List[str], batch_size: int) -> dict:
+    """
+    Genera nombres para todos los encabezados (sin caché ni persistencia).
+
+    Returns:
+        Diccionario con nombres, tiempo de carga y latencia por encabezado
+    """
+    start = time.perf_counter()
+    standardizer._load_model()
+    load_s = time.perf_counter() - start
+
+    names = []
+    start = time.perf_counter()
+    for i in range(0, len(headers), batch_size):
+        names.extend(standardizer._generate_standard_names(headers[i:i + batch_size]))
+    total_s = time.perf_counter() - start
+
+    return {
+        "names": names,
+        "load_s": load_s,
+        "ms_per_header": 1e3 * total_s / len(headers),
+    }
+
+
+def benchmark_llm(headers: List[str], model_name: str = "google/flan-t5-base",
+                  num_threads: Optional[int] = None, batch_size: int = 8) -> dict:
+    """Mide fp32 e int8 sobre los mismos encabezados."""
+    level = llm_logger.level
+    llm_logger.setLevel(logging.WARNING)
+    try:
+        results = {}
+        for label, quantize in [("fp32", False), ("int8", True)]:
+            logger.info(f"Midiendo {label}...")
+            standardizer = HeaderStandardizer(
+                model_name=model_name,
+                mappings_file=None,
+                registry=None,
+                quantize=quantize,
+                num_threads=num_threads,
+                worker_address=None,
+            )
+            results[label] = run_standardizer(standardizer, headers, batch_size)
+            del standardizer
+    finally:
+        llm_logger.setLevel(level)
+
+    fp32, int8 = results["fp32"]["names"], results["int8"]["names"]
+    disagreements = [(h, a, b) for h, a, b in zip(headers, fp32, int8) if a != b]
+    return {
+        "headers": len(headers),
+        "fp32": results["fp32"],
+        "int8": results["int8"],
+        "speedup": results["fp32"]["ms_per_header"] / results["int8"]["ms_per_header"],
+        "agreement": 1 - len(disagreements) / len(headers),
+        "disagreements": disagreements,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--model", default="google/flan-t5-base")
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--limit", type=int, default=None, help="Máximo de encabezados")
+    args = parser.parse_args()
+
+    headers = load_headers()[:args.limit]
+    result = benchmark_llm(headers, args.model, args.threads, args.batch_size)
+
+    print("\n" + "="*80)
+    print("BENCHMARK: LLM fp32 vs int8")
+    print("="*80)
+    print(f"Encabezados: {result['headers']}")
+    print(f"{'Modo':<8}{'Carga (s)':>12}{'ms/encabezado':>16}")
+    print("-"*80)
+    for mode in ("fp32", "int8"):
+        print(f"{mode:<8}{result[mode]['load_s']:>12.2f}{result[mode]['ms_per_header']:>16.1f}")
+    print(f"\nSpeedup int8: {result['speedup']:.2f}x")
+    print(f"Concordancia: {100 * result['agreement']:.1f}%")
+    for header, a, b in result['disagreements']:
+        print(f"  - {header[:50]!r}: {a} != {b}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,366 @@
+"""
+Benchmark de los matchers difusos de importadores y encabezados.
+Construye fixtures etiquetados a partir de bd-importadores.csv y
+campos_hom_data.json (nombres limpios, variantes con ruido sintético y nombres
+ajenos al catálogo) y reporta, por matcher y umbral: throughput, percentiles de
+latencia, precisión y recall.
+
+    precisión = aciertos / predicciones emitidas
+    recall    = aciertos / consultas con etiqueta
+"""
+#----------------------------
+# LIBRERÍAS
+#----------------------------
+import argparse
+import json
+import logging
+import random
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+import os
+from dotenv import load_dotenv
+
+from header_standarizer_ruler import HeaderStandardizerRules
+from importer_standarizer import (
+    build_match_index, find_best_match, find_best_match_indexed,
+    junk_char, prepare_catalog,
+)
+from text_normalization import fold_ascii
+from transform_headers import build_colname_index, search_closest_colname
+
+#----------------------------
+# VARIABLES DE ENTORNO
+#----------------------------
+load_dotenv("./variables_local.env")
+
+FOLDER_PROCESSED = os.getenv("FOLDER_PROCESSED", "data/processed/")
+BD_IMPORTADORES = os.getenv("BD_IMPORTADORES", "bd-importadores")
+MAPPING_HEADERS_FILE = os.getenv("MAPPING_HEADERS_FILE", f"{FOLDER_PROCESSED}campos_hom_data.json")
+
+IMPORTER_THRESHOLDS = (0.5, 0.6, 0.7, 0.8, 0.9)
+HEADER_THRESHOLDS = (0.7, 0.8, 0.9, 0.95)
+CONFIDENCE_THRESHOLDS = (0.5, 0.6, 0.7, 0.8)
+
+# Nombres que no están en los catálogos (la respuesta correcta es "sin match")
+UNKNOWN_IMPORTERS = [
+    "Comercial Andina de Vehiculos Ltda", "Importadora Pacifico Sur SPA",
+    "Automotriz del Maule SA", "Distribuidora Norte Grande Ltda.",
+    "Motores Australes SPA", "Sociedad Comercial Los Lagos SA",
+]
+UNKNOWN_HEADERS = [
+    "Observaciones del fabricante", "Número de puertas", "Color carrocería",
+    "Capacidad estanque (litros)", "Fecha de vencimiento certificado",
+    "Tipo de neumático delantero",
+]
+
+#----------------------------
+# CONFIGURACIONES LOGGING
+#----------------------------
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s | %(levelname)s | %(name)s | %(message)s"
+)
+logger = logging.getLogger("Benchmark Matchers")
+
+Fixture = Tuple[str, Optional[str]]       # (consulta, etiqueta esperada o None)
+Matcher = Callable[[str, float], Optional[str]]
+
+
+#----------------------------
+# INICIO CODIGO
+#----------------------------
+
+#----------------------------
+# Ruido sintético
+#----------------------------
+def _typo(text: str, rng: random.Random) -> str:
+    """Borra, sustituye, transpone o inserta un carácter."""
+    if len(text) < 3:
+        return text
+    i = rng.randrange(len(text) - 1)
+    op = rng.choice(("delete", "substitute", "transpose", "insert"))
+    letter = rng.choice("abcdefghijklmnopqrstuvwxyz")
+    if op == "delete":
+        return text[:i] + text[i+1:]
+    if op == "substitute":
+        return text[:i] + letter + text[i+1:]
+    if op == "transpose":
+        return text[:i] + text[i+1] + text[i] + text[i+2:]
+    return text[:i] + letter + text[i:]
+
+
+def _case(text: str, rng: random.Random) -> str:
+    return rng.choice((str.upper, str.lower, str.title))(text)
+
+
+def _spacing(text: str, rng: random.Random) -> str:
+    """Cambia saltos de línea y espacios (como entre versiones del Excel)."""
+    words = text.split()
+    if len(words) < 2:
+        return text + " "
+    i = rng.randrange(1, len(words))
+    sep = rng.choice((" \n", "  ", "\n"))
+    return " ".join(words[:i]) + sep + " ".join(words[i:])
+
+
+def _punctuation(text: str, rng: random.Random) -> str:
+    return text.replace(".", "").replace("-", " ").replace(",", "")
+
+
+def _legal_suffix(text: str, rng: random.Random) -> str:
+    """Quita o cambia la razón social (SPA, SA, Ltda.)."""
+    words = text.split()
+    if words and words[-1].strip(".").upper() in {"SPA", "SA", "LTDA"}:
+        replacement = rng.choice(("", "S.A.", "SpA", "Limitada"))
+        words = words[:-1] + ([replacement] if replacement else [])
+    return " ".join(words)
+
+
+NOISES = {
+    "typo": _typo,
+    "case": _case,
+    "accents": lambda text, rng: fold_ascii(text),
+    "spacing": _spacing,
+    "punctuation": _punctuation,
+    "legal_suffix": _legal_suffix,
+}
+
+
+def make_variants(text: str, n_variants: int, noises: Sequence[str], rng: random.Random) -> List[str]:
+    """Variantes ruidosas de `text`, cada una con 1 o 2 ruidos aleatorios."""
+    variants = []
+    for _ in range(n_variants):
+        variant = text
+        for noise in rng.sample(list(noises), k=min(len(noises), rng.choice((1, 2)))):
+            variant = NOISES[noise](variant, rng)
+        variants.append(variant)
+    return variants
+
+
+#----------------------------
+# Fixtures
+#----------------------------
+def importer_fixtures(bd_imp: pd.DataFrame, n_variants: int = 5, seed: int = 0) -> List[Fixture]:
+    """Consultas de importadores etiquetadas con el COD_IMP del catálogo."""
+    rng = random.Random(seed)
+    noises = ("typo", "case", "accents", "punctuation", "legal_suffix")
+    fixtures = []
+    for name, cod in zip(bd_imp["NOMBRE_EMP"], bd_imp["COD_IMP"]):
+        fixtures.append((name, cod))
+        fixtures.extend((v, cod) for v in make_variants(name, n_variants, noises, rng))
+    for name in UNKNOWN_IMPORTERS:
+        fixtures.append((name, None))
+        fixtures.extend((v, None) for v in make_variants(name, n_variants, noises, rng))
+    return fixtures
+
+
+def load_header_labels(mappings_file: str = MAPPING_HEADERS_FILE) -> Dict[str, str]:
+    """{encabezado original: nombre estándar} desde el JSON de mapeos (cualquier esquema)."""
+    with open(mappings_file, "r", encoding="utf-8") as f:
+        mappings = json.load(f)
+    return {
+        original: std_name
+        for std_name, info in mappings.items()
+        for original in info.get("original_names", info.get("default", []))
+    }
+
+
+def header_fixtures(labels: Dict[str, str], n_variants: int = 5, seed: int = 0) -> List[Fixture]:
+    """Consultas de encabezados etiquetadas con su nombre estándar."""
+    rng = random.Random(seed)
+    noises = ("typo", "case", "accents", "spacing")
+    fixtures = []
+    for original, std_name in labels.items():
+        fixtures.append((original, std_name))
+        fixtures.extend((v, std_name) for v in make_variants(original, n_variants, noises, rng))
+    for header in UNKNOWN_HEADERS:
+        fixtures.append((header, None))
+        fixtures.extend((v, None) for v in make_variants(header, n_variants, noises, rng))
+    return fixtures
+
+
+#----------------------------
+# Matchers: f(consulta, umbral) -> etiqueta o None
+#----------------------------
+def importer_matchers(bd_imp: pd.DataFrame) -> Dict[str, Matcher]:
+    catalog = prepare_catalog(bd_imp)
+    catalog_norm = catalog["_norm"].to_numpy()
+    catalog_cods = catalog["COD_IMP"].to_numpy()
+    index = build_match_index(catalog_norm, catalog["NOMBRE_COD"].to_numpy())
+
+    # Scoring de standarize_importers_old: texto crudo, caracteres basura y score > umbral
+    std_names = bd_imp["NOMBRE_EMP"].unique()
+    first_rows = bd_imp.drop_duplicates("NOMBRE_EMP")
+    old_cods = first_rows["COD_IMP"].to_numpy()
+    old_index = build_match_index(std_names, first_rows["NOMBRE_COD"].to_numpy())
+
+    def brute(raw: str, threshold: float) -> Optional[str]:
+        idx, _ = find_best_match(raw, catalog_norm, threshold)
+        return None if idx is None else catalog_cods[idx]
+
+    def indexed(raw: str, threshold: float) -> Optional[str]:
+        idx, _ = find_best_match_indexed(raw, index, threshold)
+        return None if idx is None else catalog_cods[idx]
+
+    def old(raw: str, threshold: float) -> Optional[str]:
+        idx, score = find_best_match_indexed(raw, old_index, 0.0, query=str(raw), isjunk=junk_char)
+        return old_cods[idx] if score > threshold else None
+
+    return {
+        "find_best_match": brute,
+        "find_best_match_indexed": indexed,
+        "standarize_importers_old": old,
+    }
+
+
+def header_matchers(labels: Dict[str, str]) -> Dict[str, Matcher]:
+    colnames_df = pd.DataFrame({"STANDARD_NAME": list(labels.values()),
+                                "3CV_NAMES": list(labels.keys())})
+    index = build_colname_index(colnames_df)
+    n_names = len(index["3CV_NAMES"])
+
+    def closest(top_k: int) -> Matcher:
+        return lambda raw, threshold: search_closest_colname(
+            raw, colnames_df, ratio_min=threshold, index=index, top_k=top_k)
+
+    return {
+        "search_closest_colname": closest(10),
+        "search_closest_colname (sin poda)": closest(n_names),
+    }
+
+
+#----------------------------
+# Medición
+#----------------------------
+def evaluate(matcher: Matcher, fixtures: List[Fixture], threshold: float) -> dict:
+    """Throughput, latencias y precisión/recall de un matcher a un umbral."""
+    latencies = np.empty(len(fixtures))
+    emitted = correct = 0
+    for i, (query, label) in enumerate(fixtures):
+        start = time.perf_counter()
+        predicted = matcher(query, threshold)
+        latencies[i] = time.perf_counter() - start
+        if predicted is not None:
+            emitted += 1
+            correct += predicted == label
+    positives = sum(label is not None for _, label in fixtures)
+    p50, p95, p99 = 1e6 * np.percentile(latencies, [50, 95, 99])
+    return {
+        "threshold": threshold,
+        "queries_s": len(fixtures) / latencies.sum(),
+        "p50_us": p50,
+        "p95_us": p95,
+        "p99_us": p99,
+        "precision": correct / emitted if emitted else float("nan"),
+        "recall": correct / positives if positives else float("nan"),
+    }
+
+
+def benchmark_matchers(matchers: Dict[str, Matcher], fixtures: List[Fixture],
+                       thresholds: Sequence[float]) -> Dict[str, List[dict]]:
+    """Evalúa cada matcher en cada umbral sobre los mismos fixtures."""
+    results = {}
+    for name, matcher in matchers.items():
+        logger.info(f"Midiendo {name}...")
+        for query, _ in fixtures[:20]:  # calentamiento
+            matcher(query, thresholds[0])
+        results[name] = [evaluate(matcher, fixtures, t) for t in thresholds]
+    return results
+
+
+def print_report(title: str, fixtures: List[Fixture], results: Dict[str, List[dict]]) -> None:
+    positives = sum(label is not None for _, label in fixtures)
+    print("\n" + "="*96)
+    print(f"BENCHMARK: {title}")
+    print("="*96)
+    print(f"Consultas: {len(fixtures)} ({positives} con etiqueta, {len(fixtures) - positives} sin match)")
+    print(f"{'Matcher':<36}{'Umbral':>7}{'Consultas/s':>13}{'p50 (us)':>10}"
+          f"{'p95 (us)':>10}{'p99 (us)':>10}{'Precisión':>10}{'Recall':>8}")
+    print("-"*96)
+    for name, rows in results.items():
+        for r in rows:
+            print(f"{name:<36}{r['threshold']:>7.2f}{r['queries_s']:>13.0f}{r['p50_us']:>10.1f}"
+                  f"{r['p95_us']:>10.1f}{r['p99_us']:>10.1f}{r['precision']:>10.3f}{r['recall']:>8.3f}")
+
+
+def confidence_fixtures(labels: Dict[str, str], rules: HeaderStandardizerRules,
+                        n_variants: int = 5, seed: int = 0) -> Dict[str, List[Tuple[str, bool]]]:
+    """
+    Nombres generados por las reglas y si son correctos, en dos grupos que no
+    intervienen en el vocabulario de score_confidence:
+      - "reservadas": la mitad de los nombres estándar (al azar con `seed`)
+        con sus encabezados y variantes; la otra mitad queda para ajustar
+      - "nuevos": UNKNOWN_HEADERS y sus variantes; el nombre correcto es el que
+        las reglas generan para el encabezado limpio
+    """
+    rng = random.Random(seed)
+    names = sorted(set(labels.values()))
+    rng.shuffle(names)
+    held_out = set(names[:len(names) // 2])
+    groups = {"ajuste": [], "reservadas": [], "nuevos": []}
+    for query, label in header_fixtures(labels, n_variants, seed):
+        if label is None:
+            continue
+        std_name = rules._generate_standard_name(query)
+        groups["reservadas" if label in held_out else "ajuste"].append((std_name, std_name == label))
+    noises = ("typo", "case", "accents", "spacing")
+    for header in UNKNOWN_HEADERS:
+        expected = rules._generate_standard_name(header)
+        for query in [header] + make_variants(header, n_variants, noises, rng):
+            std_name = rules._generate_standard_name(query)
+            groups["nuevos"].append((std_name, std_name == expected))
+    return groups
+
+
+def confidence_report(labels: Dict[str, str], n_variants: int = 5, seed: int = 0,
+                      thresholds: Sequence[float] = CONFIDENCE_THRESHOLDS) -> None:
+    """
+    Calibración de HeaderStandardizerRules.score_confidence: por grupo y umbral,
+    qué parte de los nombres correctos e incorrectos se enviaría al LLM.
+    """
+    rules = HeaderStandardizerRules(None)
+    known_terms = rules.known_terms()
+    groups = confidence_fixtures(labels, rules, n_variants, seed)
+    print("\n" + "="*96)
+    print("CALIBRACIÓN: CONFIANZA DE LAS REGLAS")
+    print("="*96)
+    print(f"{'Grupo':<12}{'Umbral':>7}{'Correctos':>11}{'Incorrectos':>13}"
+          f"{'Correctos al LLM':>20}{'Incorrectos al LLM':>22}")
+    print("-"*96)
+    for group, rows in groups.items():
+        scored = [(ok, rules.score_confidence(std_name, known_terms)) for std_name, ok in rows]
+        n_good = sum(ok for ok, _ in scored)
+        n_bad = len(scored) - n_good
+        for threshold in thresholds:
+            good = sum(ok and conf < threshold for ok, conf in scored)
+            bad = sum(not ok and conf < threshold for ok, conf in scored)
+            print(f"{group:<12}{threshold:>7.2f}{n_good:>11}{n_bad:>13}"
+                  f"{good / max(n_good, 1):>20.3f}{bad / max(n_bad, 1):>22.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--importers-file", default=f"{FOLDER_PROCESSED}{BD_IMPORTADORES}.csv")
+    parser.add_argument("--headers-file", default=MAPPING_HEADERS_FILE)
+    parser.add_argument("--variants", type=int, default=5, help="Variantes ruidosas por nombre")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    bd_imp = pd.read_csv(args.importers_file)
+    fixtures = importer_fixtures(bd_imp, args.variants, args.seed)
+    results = benchmark_matchers(importer_matchers(bd_imp), fixtures, IMPORTER_THRESHOLDS)
+    print_report("MATCHERS DE IMPORTADORES", fixtures, results)
+
+    labels = load_header_labels(args.headers_file)
+    fixtures = header_fixtures(labels, args.variants, args.seed)
+    results = benchmark_matchers(header_matchers(labels), fixtures, HEADER_THRESHOLDS)
+    print_report("MATCHERS DE ENCABEZADOS", fixtures, results)
+    confidence_report(labels, args.variants, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+"""
+Worker local persistente para el estandarizador de encabezados con LLM
+Un único proceso mantiene el modelo cargado y atiende solicitudes por un socket
+local; las solicitudes concurrentes se agrupan en micro-lotes antes de llamar
+a `generate`. Así varios pipelines o backfills en paralelo comparten un modelo
+ya cargado en lugar de pagar cada uno la carga y la memoria.
+
+Uso:
+    python src/header_llm_worker.py --address tmp/header_llm_worker.sock
+y en los clientes definir LLM_WORKER_ADDRESS con la misma dirección.
+
+Autenticación: la clave se toma de LLM_WORKER_AUTHKEY o, si no está definida,
+del archivo `<address>.key` (solo lectura para el usuario), que el worker crea
+con una clave aleatoria al iniciar. El socket también queda con permisos 0600.
+"""
+#----------------------------
+# LIBRERÍAS
+#----------------------------
+import argparse
+import logging
+import queue
+import secrets
+import threading
+import time
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import os
+from dotenv import load_dotenv
+
+#----------------------------
+# VARIABLES DE ENTORNO
+#----------------------------
+load_dotenv("./variables_local.env")
+LLM_WORKER_ADDRESS = os.getenv("LLM_WORKER_ADDRESS")
+LLM_WORKER_AUTHKEY = os.getenv("LLM_WORKER_AUTHKEY")
+
+#----------------------------
+# CONFIGURACIONES LOGGING
+#----------------------------
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s | %(levelname)s | %(name)s | %(message)s"
+)
+logger = logging.getLogger("HeaderLLMWorker")
+
+
+#----------------------------
+# INICIO CÓDIGO
+#----------------------------
+
+class WorkerUnavailable(ConnectionError):
+    """No hay conexión con el worker (no está corriendo, se cayó o rechaza la clave)."""
+
+
+def key_file(address: str) -> Path:
+    return Path(f"{address}.key")
+
+
+def load_authkey(address: str, create: bool = False) -> bytes:
+    """
+    Clave del worker: LLM_WORKER_AUTHKEY o el archivo de clave del socket.
+    Con `create` (servidor) se genera una clave aleatoria en un archivo 0600.
+    """
+    if LLM_WORKER_AUTHKEY:
+        return LLM_WORKER_AUTHKEY.encode()
+    path = key_file(address)
+    if create:
+        path.unlink(missing_ok=True)
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, "w") as f:
+            f.write(secrets.token_hex(32))
+    try:
+        return path.read_text().strip().encode()
+    except FileNotFoundError:
+        raise WorkerUnavailable(f"Sin LLM_WORKER_AUTHKEY ni archivo de clave {path}") from None
+
+
+class _Request:
+    """Solicitud pendiente de un cliente."""
+
+    def __init__(self, headers: List[str]):
+        self.headers = headers
+        self.names: Optional[List[str]] = None
+        self.error: Optional[str] = None
+        self.done = threading.Event()
+
+
+class HeaderModelServer:
+    """
+    Servidor que mantiene un HeaderStandardizer cargado y agrupa solicitudes.
+
+    Cada conexión se atiende en un hilo que encola sus solicitudes; un único
+    hilo de inferencia toma la primera solicitud de la cola, espera hasta
+    `max_wait_ms` por otras (o hasta juntar `max_batch_size` encabezados) y
+    genera todo el micro-lote de una vez.
+    """
+
+    def __init__(
+        self,
+        address: str = LLM_WORKER_ADDRESS,
+        model_name: str = "google/flan-t5-base",
+        max_batch_size: int = 16,
+        max_wait_ms: float = 20.0,
+        quantize: bool = False,
+        num_threads: Optional[int] = None,
+        authkey: Optional[bytes] = None,
+    ):
+        from header_standarizer_llm import HeaderStandardizer
+
+        if not address:
+            raise ValueError("No se definió dirección para el worker (LLM_WORKER_ADDRESS).")
+        self.address = address
+        self.authkey = authkey if authkey is not None else load_authkey(address, create=True)
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue: "queue.Queue[Optional[_Request]]" = queue.Queue()
+        # El worker genera localmente: nunca se reenvía a otro worker
+        self.standardizer = HeaderStandardizer(
+            model_name=model_name,
+            mappings_file=None,
+            quantize=quantize,
+            num_threads=num_threads,
+            worker_address=None,
+        )
+
+    def _collect_batch(self, first: _Request) -> List[_Request]:
+        """Junta solicitudes hasta llenar el lote o agotar la espera."""
+        batch = [first]
+        size = len(first.headers)
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if request is None:
+                self._queue.put(None)
+                break
+            batch.append(request)
+            size += len(request.headers)
+        return batch
+
+    def _inference_loop(self) -> None:
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch = self._collect_batch(first)
+            unique = list(dict.fromkeys(h for request in batch for h in request.headers))
+            logger.info(f"Micro-lote: {len(batch)} solicitudes, {len(unique)} encabezados")
+            try:
+                names = self.standardizer.generate_in_batches(unique, self.max_batch_size)
+                for request in batch:
+                    request.names = [names[h] for h in request.headers]
+            except Exception as e:
+                logger.exception("Error generando micro-lote")
+                for request in batch:
+                    request.error = str(e)
+            for request in batch:
+                request.done.set()
+
+    def _serve_connection(self, conn) -> None:
+        with conn:
+            while True:
+                try:
+                    message = conn.recv()
+                except EOFError:
+                    return
+                request = _Request(list(message["headers"]))
+                self._queue.put(request)
+                request.done.wait()
+                if request.error is None:
+                    conn.send({"names": request.names})
+                else:
+                    conn.send({"error": request.error})
+
+    def serve_forever(self) -> None:
+        """Carga el modelo y atiende conexiones hasta interrumpir el proceso."""
+        self.standardizer._load_model()
+        Path(self.address).unlink(missing_ok=True)
+        inference = threading.Thread(target=self._inference_loop, daemon=True)
+        inference.start()
+        # Socket solo accesible por el usuario (umask durante su creación)
+        umask = os.umask(0o177)
+        try:
+            listener = Listener(self.address, authkey=self.authkey)
+        finally:
+            os.umask(umask)
+        with listener:
+            logger.info(f"Worker escuchando en {self.address}")
+            try:
+                while True:
+                    conn = listener.accept()
+                    threading.Thread(target=self._serve_connection, args=(conn,), daemon=True).start()
+            except KeyboardInterrupt:
+                logger.info("Worker detenido")
+            finally:
+                self._queue.put(None)
+
+
+class HeaderModelClient:
+    """Cliente del worker: envía encabezados y recibe los nombres generados."""
+
+    def __init__(self, address: str = LLM_WORKER_ADDRESS, authkey: Optional[bytes] = None):
+        self.address = address
+        self.authkey = authkey
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _request(self, headers: List[str]) -> dict:
+        if self._conn is None:
+            authkey = self.authkey if self.authkey is not None else load_authkey(self.address)
+            self._conn = Client(self.address, authkey=authkey)
+        self._conn.send({"headers": list(headers)})
+        return self._conn.recv()
+
+    def generate(self, headers: List[str]) -> List[str]:
+        """
+        Nombres generados por el worker, en el mismo orden de `headers`.
+        Si la conexión se cortó (p.ej. el worker se reinició) se reconecta y
+        reintenta una vez; si tampoco resulta, lanza WorkerUnavailable.
+        """
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    response = self._request(headers)
+                    break
+                except WorkerUnavailable:
+                    raise
+                except (EOFError, OSError, AuthenticationError) as e:
+                    self.close()
+                    if attempt:
+                        raise WorkerUnavailable(f"Worker LLM no disponible en {self.address}: {e}") from e
+                    logger.warning(f"Conexión con el worker perdida ({e!r}), reintentando")
+        if "error" in response:
+            raise RuntimeError(f"Error en worker LLM: {response['error']}")
+        return response["names"]
+
+    def close(self) -> None:
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except OSError:
+                pass
+            self._conn = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Worker local del estandarizador LLM")
+    parser.add_argument("--address", default=LLM_WORKER_ADDRESS or "tmp/header_llm_worker.sock")
+    parser.add_argument("--model", default="google/flan-t5-base")
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--max-wait-ms", type=float, default=20.0)
+    parser.add_argument("--quantize", action="store_true")
+    parser.add_argument("--threads", type=int, default=None)
+    args = parser.parse_args()
+
+    server = HeaderModelServer(
+        address=args.address,
+        model_name=args.model,
+        max_batch_size=args.batch_size,
+        max_wait_ms=args.max_wait_ms,
+        quantize=args.quantize,
+        num_threads=args.threads,
+    )
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,326 @@
+"""
+Registro de mapeos de encabezados en SQLite
+Almacén único e indexado para HeaderStandardizerRules, HeaderStandardizer y
+transform_headers, seguro frente a escritores concurrentes (varios pipelines
+pueden compartir el mismo archivo sin reescribirlo completo ni perder cambios).
+
+Migración: al activar MAPPING_REGISTRY_DB cada estandarizador importa su JSON
+de mapeos existente (import_json_once) la primera vez que abre el registro, así
+los nombres curados no se pierden. También se puede migrar a mano:
+    python src/header_registry.py data/processed/campos_hom_data.json ...
+"""
+#----------------------------
+# LIBRERÍAS
+#----------------------------
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+#----------------------------
+# VARIABLES DE ENTORNO
+#----------------------------
+load_dotenv("./variables_local.env")
+MAPPING_REGISTRY_DB = os.getenv("MAPPING_REGISTRY_DB")
+# Largo único de los hashes de encabezado para todos los que escriben en el
+# registro (transform_headers, reglas y LLM); 12 es el largo de los JSON existentes
+HASH_LENGTH = int(os.getenv("HASH_LENGHT") or 12)
+
+#----------------------------
+# CONFIGURACIONES LOGGING
+#----------------------------
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s | %(levelname)s | %(name)s | %(message)s"
+)
+logger = logging.getLogger("HeaderMappingRegistry")
+
+# Esquemas de los JSON existentes: (clave nombres originales, clave hashes)
+JSON_SCHEMAS = {
+    "rules": ("original_names", "hashes"),  # HeaderStandardizerRules / HeaderStandardizer
+    "3cv": ("default", "hash"),             # transform_headers (campos_hom_data.json)
+}
+
+_SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS standard_names (
+    standard_name TEXT PRIMARY KEY,
+    created_at    TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS header_hashes (
+    hash          TEXT PRIMARY KEY,
+    original_name TEXT NOT NULL,
+    standard_name TEXT NOT NULL REFERENCES standard_names(standard_name)
+);
+CREATE INDEX IF NOT EXISTS idx_header_hashes_standard_name
+    ON header_hashes(standard_name);
+CREATE TABLE IF NOT EXISTS imported_files (
+    path        TEXT PRIMARY KEY,
+    imported_at TEXT NOT NULL
+);
+"""
+
+
+#----------------------------
+# INICIO CÓDIGO
+#----------------------------
+
+def header_hash(text: str, length: int = HASH_LENGTH) -> str:
+    """Hash SHA256 truncado de un encabezado original (clave de header_hashes)."""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()[:length]
+
+
+class HeaderMappingRegistry:
+    """
+    Registro persistente {hash de encabezado original -> nombre estándar}.
+
+    Cada escritura es una transacción corta (BEGIN IMMEDIATE) sobre SQLite en
+    modo WAL: la búsqueda del hash, la resolución de colisiones y la inserción
+    ocurren de forma atómica, por lo que dos procesos no pueden asignar el
+    mismo nombre ni pisar el registro del otro.
+    """
+
+    def __init__(self, db_file: str = MAPPING_REGISTRY_DB, timeout: float = 30.0):
+        """
+        Args:
+            db_file: Archivo SQLite del registro (se crea si no existe)
+            timeout: Segundos de espera ante un bloqueo de otro escritor
+        """
+        if not db_file:
+            raise ValueError("No se definió archivo para el registro (MAPPING_REGISTRY_DB).")
+        self.db_file = Path(db_file)
+        self.timeout = timeout
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+        self._connect()
+        logger.info(f"Registro de mapeos en {self.db_file}")
+
+    # La conexión no se comparte entre procesos: se reabre al deserializar
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state["_conn"] = None
+        state["_pid"] = None
+        return state
+
+    def _connect(self) -> sqlite3.Connection:
+        """Devuelve la conexión del proceso actual, creándola si hace falta."""
+        if self._conn is None or self._pid != os.getpid():
+            self.db_file.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.db_file, timeout=self.timeout, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA busy_timeout={int(self.timeout * 1000)}")
+            conn.executescript(_SCHEMA_SQL)
+            self._conn = conn
+            self._pid = os.getpid()
+        return self._conn
+
+    def _write(self, func, *args):
+        """Ejecuta func(conn, *args) dentro de una transacción de escritura."""
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = func(conn, *args)
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return result
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    #----------------------------
+    # Lectura
+    #----------------------------
+    def lookup(self, header_hash: str) -> Optional[str]:
+        """Nombre estándar asociado al hash o None si no está registrado."""
+        row = self._connect().execute(
+            "SELECT standard_name FROM header_hashes WHERE hash = ?", (header_hash,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def lookup_many(self, hashes: Iterable[str]) -> Dict[str, str]:
+        """Versión en lote de lookup: {hash: nombre estándar} de los hashes registrados."""
+        hashes = list(dict.fromkeys(hashes))
+        found = {}
+        conn = self._connect()
+        # SQLite limita la cantidad de parámetros por consulta
+        for i in range(0, len(hashes), 500):
+            chunk = hashes[i:i + 500]
+            rows = conn.execute(
+                f"SELECT hash, standard_name FROM header_hashes "
+                f"WHERE hash IN ({','.join('?' * len(chunk))})", chunk
+            ).fetchall()
+            found.update(rows)
+        return found
+
+    def has_standard_name(self, standard_name: str) -> bool:
+        row = self._connect().execute(
+            "SELECT 1 FROM standard_names WHERE standard_name = ?", (standard_name,)
+        ).fetchone()
+        return row is not None
+
+    def to_dict(self, schema: str = "rules") -> Dict[str, Dict[str, List[str]]]:
+        """
+        Exporta el registro con la forma de los JSON existentes.
+
+        Args:
+            schema: "rules" ({original_names, hashes}) o "3cv" ({default, hash})
+        """
+        names_key, hashes_key = JSON_SCHEMAS[schema]
+        # Una sola consulta: lectura consistente aunque otro proceso esté escribiendo
+        rows = self._connect().execute(
+            "SELECT s.standard_name, h.original_name, h.hash "
+            "FROM standard_names s LEFT JOIN header_hashes h ON h.standard_name = s.standard_name "
+            "ORDER BY s.rowid, h.rowid"
+        )
+        mappings = {}
+        for name, original, header_hash in rows:
+            info = mappings.setdefault(name, {names_key: [], hashes_key: []})
+            if header_hash is not None:
+                info[names_key].append(original)
+                info[hashes_key].append(header_hash)
+        return mappings
+
+    #----------------------------
+    # Escritura
+    #----------------------------
+    def register(self, standard_name: str, original_header: str, header_hash: str,
+                 resolve_collisions: bool = True) -> str:
+        """
+        Registra un encabezado nuevo de forma atómica.
+
+        Si el hash ya existe (p.ej. lo registró otro proceso) devuelve el nombre
+        existente. Con resolve_collisions, un nombre ya usado recibe sufijos
+        _1, _2, ... como en los estandarizadores; si no, el encabezado se agrega
+        como alias del nombre existente.
+
+        Returns:
+            Nombre estándar finalmente asignado
+        """
+        return self._write(self._register, standard_name, original_header,
+                           header_hash, resolve_collisions)
+
+    @staticmethod
+    def _register(conn: sqlite3.Connection, standard_name: str, original_header: str,
+                  header_hash: str, resolve_collisions: bool) -> str:
+        row = conn.execute(
+            "SELECT standard_name FROM header_hashes WHERE hash = ?", (header_hash,)
+        ).fetchone()
+        if row:
+            return row[0]
+
+        def exists(name: str) -> bool:
+            return conn.execute(
+                "SELECT 1 FROM standard_names WHERE standard_name = ?", (name,)
+            ).fetchone() is not None
+
+        if resolve_collisions:
+            base_name = standard_name
+            counter = 1
+            while exists(standard_name):
+                standard_name = f"{base_name}_{counter}"
+                counter += 1
+
+        conn.execute(
+            "INSERT OR IGNORE INTO standard_names (standard_name, created_at) VALUES (?, ?)",
+            (standard_name, datetime.now().isoformat(timespec="seconds")),
+        )
+        conn.execute(
+            "INSERT INTO header_hashes (hash, original_name, standard_name) VALUES (?, ?, ?)",
+            (header_hash, original_header, standard_name),
+        )
+        return standard_name
+
+    def merge_dict(self, mappings: Dict[str, Dict[str, List[str]]], schema: str = "rules") -> int:
+        """
+        Incorpora un diccionario con la forma de los JSON existentes.
+        Los hashes ya registrados se conservan (no se sobreescriben).
+
+        Returns:
+            Cantidad de hashes nuevos insertados
+        """
+        inserted = self._write(self._merge, mappings, schema)
+        logger.info(f"Registro actualizado: {inserted} hashes nuevos")
+        return inserted
+
+    @staticmethod
+    def _merge(conn: sqlite3.Connection, mappings: Dict[str, Dict[str, List[str]]], schema: str) -> int:
+        names_key, hashes_key = JSON_SCHEMAS[schema]
+        now = datetime.now().isoformat(timespec="seconds")
+        names = [(name, now) for name in mappings]
+        rows: List[Tuple[str, str, str]] = [
+            (header_hash, original, name)
+            for name, info in mappings.items()
+            for original, header_hash in zip(info[names_key], info[hashes_key])
+        ]
+        conn.executemany(
+            "INSERT OR IGNORE INTO standard_names (standard_name, created_at) VALUES (?, ?)",
+            names,
+        )
+        before = conn.total_changes
+        conn.executemany(
+            "INSERT OR IGNORE INTO header_hashes (hash, original_name, standard_name) VALUES (?, ?, ?)",
+            rows,
+        )
+        return conn.total_changes - before
+
+    @staticmethod
+    def _import(conn: sqlite3.Connection, json_file: Path, mappings: dict, once: bool) -> Optional[int]:
+        path = str(json_file.resolve())
+        if once and conn.execute("SELECT 1 FROM imported_files WHERE path = ?", (path,)).fetchone():
+            return None
+        inserted = 0
+        if mappings:
+            first = next(iter(mappings.values()))
+            schema = "3cv" if "default" in first else "rules"
+            logger.info(f"Importando {len(mappings)} mapeos desde {json_file} (esquema {schema})")
+            inserted = HeaderMappingRegistry._merge(conn, mappings, schema)
+        conn.execute(
+            "INSERT OR REPLACE INTO imported_files (path, imported_at) VALUES (?, ?)",
+            (path, datetime.now().isoformat(timespec="seconds")),
+        )
+        return inserted
+
+    def import_json(self, json_file: str) -> int:
+        """Migra un archivo de mapeos JSON (cualquiera de los dos esquemas) al registro."""
+        with open(json_file, 'r', encoding='utf-8') as f:
+            mappings = json.load(f)
+        return self._write(self._import, Path(json_file), mappings, False)
+
+    def import_json_once(self, json_file: Optional[str]) -> int:
+        """
+        Migra el JSON de mapeos si existe y aún no se importó a este registro.
+        La verificación y la importación son una sola transacción: si varios
+        procesos abren el registro a la vez, solo uno importa.
+        """
+        if not json_file or not Path(json_file).exists():
+            return 0
+        with open(json_file, 'r', encoding='utf-8') as f:
+            mappings = json.load(f)
+        inserted = self._write(self._import, Path(json_file), mappings, True)
+        if inserted is None:
+            return 0
+        logger.info(f"Mapeos de {json_file} migrados al registro: {inserted} hashes nuevos")
+        return inserted
+
+def main():
+    """Migra los JSON de mapeos indicados al registro SQLite."""
+    import sys
+
+    registry = HeaderMappingRegistry()
+    for json_file in sys.argv[1:]:
+        registry.import_json(json_file)
+    print(f"Nombres estándar registrados: {len(registry.to_dict())}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+Estandarización de encabezados en cascada: REGLAS -> LLM
+Las reglas generan todos los nombres nuevos y puntúan su confianza; solo los
+encabezados con baja confianza se envían al LLM. Ambos resultados se guardan
+en el mismo almacén de mapeos (JSON o registro SQLite de las reglas).
+"""
+#----------------------------
+# LIBRERÍAS
+#----------------------------
+import logging
+from typing import Dict, List, Optional
+
+import os
+from dotenv import load_dotenv
+
+from header_standarizer_ruler import HeaderStandardizerRules
+from header_standarizer_llm import HeaderStandardizer
+
+#----------------------------
+# VARIABLES DE ENTORNO
+#----------------------------
+load_dotenv("./variables_local.env")
+MAPPING_HEADERS_FILE = os.getenv("MAPPING_HEADERS_FILE")
+
+#----------------------------
+# CONFIGURACIONES LOGGING
+#----------------------------
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s | %(levelname)s | %(name)s | %(message)s"
+)
+logger = logging.getLogger("HeaderStandardizerCascade")
+
+
+#----------------------------
+# INICIO CÓDIGO
+#----------------------------
+
+class HeaderStandardizerCascade:
+    """
+    Combina HeaderStandardizerRules (microsegundos por encabezado) con
+    HeaderStandardizer (LLM) para los casos difíciles.
+    """
+
+    def __init__(
+        self,
+        rules: Optional[HeaderStandardizerRules] = None,
+        llm: Optional[HeaderStandardizer] = None,
+        min_confidence: float = 0.6,
+        batch_size: int = 8,
+        model_name: str = "google/flan-t5-base",
+    ):
+        """
+        Args:
+            rules: Estandarizador por reglas; su almacén de mapeos es el de la cascada
+            llm: Estandarizador LLM (se crea al primer encabezado de baja confianza)
+            min_confidence: Bajo este puntaje el encabezado se envía al LLM (con 0.6:
+                fallback por hash, nombres cortos o con fragmentos; ver score_confidence)
+            batch_size: Encabezados por llamada al modelo
+            model_name: Modelo a usar si no se entrega `llm`
+        """
+        self.rules = rules if rules is not None else HeaderStandardizerRules(MAPPING_HEADERS_FILE)
+        self._llm = llm
+        self.min_confidence = min_confidence
+        self.batch_size = batch_size
+        self.model_name = model_name
+        # Origen de cada nombre del último batch: "cache", "rules" o "llm"
+        self.sources: Dict[str, str] = {}
+        self.confidences: Dict[str, float] = {}
+
+    @property
+    def llm(self) -> HeaderStandardizer:
+        if self._llm is None:
+            # Solo se usa para generar: los mapeos viven en el almacén de las reglas
+            self._llm = HeaderStandardizer(
+                model_name=self.model_name,
+                mappings_file=None,
+                registry=self.rules.registry,
+            )
+        return self._llm
+
+    @property
+    def mappings(self) -> Dict[str, Dict]:
+        return self.rules.mappings
+
+    def batch_standardize(self, headers: List[str]) -> Dict[str, str]:
+        """
+        Estandariza múltiples encabezados.
+
+        Returns:
+            Diccionario {original: estandarizado}
+        """
+        headers = list(headers)
+        logger.info(f"Procesando batch de {len(headers)} encabezados...")
+        hashes = [self.rules._compute_hash(h) for h in headers]
+
+        # Encabezados nuevos (únicos, en orden de aparición)
+        misses = {}
+        for header, header_hash in zip(headers, hashes):
+            if header not in misses and self.rules._find_cached(header_hash) is None:
+                misses[header] = header_hash
+
+        # Paso 1: reglas + confianza
+        known_terms = self.rules.known_terms()
+        generated = {}
+        self.sources, self.confidences = {}, {}
+        for header in misses:
+            std_name = self.rules._generate_standard_name(header)
+            generated[header] = std_name
+            self.sources[header] = "rules"
+            self.confidences[header] = self.rules.score_confidence(std_name, known_terms)
+
+        # Paso 2: LLM solo para los de baja confianza
+        hard = [h for h in misses if self.confidences[h] < self.min_confidence]
+        if hard:
+            logger.info(f"{len(hard)}/{len(misses)} encabezados con baja confianza -> LLM")
+            for header, llm_name in self.llm.generate_in_batches(hard, self.batch_size).items():
+                # El fallback por hash del LLM no mejora el nombre de las reglas
+                if not llm_name.upper().startswith("COL_"):
+                    generated[header] = llm_name.upper()
+                    self.sources[header] = "llm"
+
+        # Paso 3: fusión en orden, en el almacén de las reglas
+        mapping = {}
+        for header, header_hash in zip(headers, hashes):
+            std_name = self.rules._find_cached(header_hash)
+            if std_name is None:
+                std_name = self.rules._register_name(generated[header], header, header_hash)
+            else:
+                self.sources.setdefault(header, "cache")
+            mapping[header] = std_name
+
+        if generated:
+            self.rules._save_mappings()
+        logger.info(f"Batch completado: {len(mapping)} encabezados "
+                    f"({sum(s == 'llm' for s in self.sources.values())} por LLM)")
+        return mapping
+
+    def export_to_csv(self, output_file: str = "header_mappings.csv") -> None:
+        """Exporta mapeos a CSV."""
+        self.rules.export_to_csv(output_file)
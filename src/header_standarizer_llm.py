@@ -6,17 +6,16 @@ Genera nombres cortos y manejables para columnas con nombres complejos
 # LIBRERÍAS
 #----------------------------
 import json
-import hashlib
 import logging
 from pathlib import Path
 from typing import Dict, List, Optional, Tuple
 
-import torch
-from transformers import AutoTokenizer, AutoModelForSeq2SeqLM, pipeline
-
 import os
 from dotenv import load_dotenv
 
+from header_registry import HeaderMappingRegistry, MAPPING_REGISTRY_DB, HASH_LENGTH, header_hash
+from header_llm_worker import HeaderModelClient, LLM_WORKER_ADDRESS, WorkerUnavailable
+
 #----------------------------
 # VARIABLES DE ENTORNO
 #----------------------------
@@ -49,36 +48,116 @@ class HeaderStandardizer:
         self,
         model_name: str = "google/flan-t5-base",
         mappings_file: str = MAPPING_HEADERS_FILE,
-        hash_length: int = 12
+        hash_length: int = HASH_LENGTH,
+        registry: Optional[HeaderMappingRegistry] = None,
+        use_safetensors: bool = True,
+        quantize: bool = False,
+        num_threads: Optional[int] = None,
+        worker_address: Optional[str] = LLM_WORKER_ADDRESS
     ):
         """
         Args:
             model_name: Modelo HuggingFace a utilizar
-            mappings_file: Archivo JSON para persistir mapeos
-            hash_length: Longitud del hash (caracteres)
+            mappings_file: Archivo JSON para persistir mapeos (si no hay registro)
+            hash_length: Longitud del hash (caracteres); con registro debe ser HASH_LENGTH
+            registry: Registro SQLite compartido. Por defecto se usa el definido
+                en MAPPING_REGISTRY_DB, si existe; si no, el archivo JSON. Al
+                abrirlo se migra `mappings_file` la primera vez (import_json_once).
+            use_safetensors: Cargar pesos desde safetensors (memory-mapped)
+            quantize: Inferencia int8 en CPU (cuantización dinámica de las capas Linear)
+            num_threads: Hilos intra-op de torch (None: valor por defecto de torch)
+            worker_address: Socket de un worker local (header_llm_worker.py) que ya
+                tiene el modelo cargado; si se define, la generación se delega en él
+
+        El tokenizer y el modelo se cargan recién en el primer encabezado que no
+        está en caché: una corrida con todo cacheado no importa torch ni carga pesos.
         """
-        self.mappings_file = Path(mappings_file)
+        if registry is None and MAPPING_REGISTRY_DB:
+            registry = HeaderMappingRegistry(MAPPING_REGISTRY_DB)
+        if registry is not None and hash_length != HASH_LENGTH:
+            raise ValueError(f"El registro compartido usa hashes de {HASH_LENGTH} caracteres "
+                             f"(HASH_LENGHT), no {hash_length}.")
+        if registry is not None:
+            # Sin esto el primer uso del registro partiría vacío y perdería los mapeos JSON
+            registry.import_json_once(mappings_file)
+        self.registry = registry
+        self.mappings_file = Path(mappings_file) if mappings_file else None
         self.hash_length = hash_length
         self.mappings: Dict[str, Dict] = {}
 
-        # Inicializar modelo
-        logger.info(f"Inicializando modelo {model_name}...")
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
-        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
-        self.model = AutoModelForSeq2SeqLM.from_pretrained(model_name)
-        self.model.to(self.device)
-        logger.info(f"Modelo cargado. Device: {self.device}")
+        # Modelo (carga diferida, ver _load_model)
+        self.model_name = model_name
+        self.use_safetensors = use_safetensors
+        self.quantize = quantize
+        self.num_threads = num_threads
+        self.worker = HeaderModelClient(worker_address) if worker_address else None
+        self._tokenizer = None
+        self._model = None
+        self._device: Optional[str] = None
 
         # Cargar mapeos existentes
         self._load_mappings()
 
+    def _load_model(self) -> None:
+        """
+        Carga tokenizer y modelo si aún no están cargados. Los pesos se leen
+        desde safetensors, que se mapean en memoria en lugar de copiarse, y
+        low_cpu_mem_usage evita instanciar primero un modelo con pesos aleatorios.
+        """
+        if self._model is not None:
+            return
+        import torch
+        from transformers import AutoTokenizer, AutoModelForSeq2SeqLM
+
+        logger.info(f"Inicializando modelo {self.model_name}...")
+        if self.num_threads:
+            torch.set_num_threads(self.num_threads)
+        # La cuantización dinámica solo tiene kernels de CPU
+        self._device = "cuda" if torch.cuda.is_available() and not self.quantize else "cpu"
+        self._tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+        model = AutoModelForSeq2SeqLM.from_pretrained(
+            self.model_name,
+            use_safetensors=self.use_safetensors,
+            low_cpu_mem_usage=True,
+        )
+        model.eval()
+        if self.quantize:
+            model = torch.ao.quantization.quantize_dynamic(
+                model, {torch.nn.Linear}, dtype=torch.qint8
+            )
+        self._model = model.to(self._device)
+        logger.info(f"Modelo cargado. Device: {self._device} | int8: {self.quantize} "
+                    f"| hilos: {torch.get_num_threads()}")
+
+    @property
+    def tokenizer(self):
+        self._load_model()
+        return self._tokenizer
+
+    @property
+    def model(self):
+        self._load_model()
+        return self._model
+
+    @property
+    def device(self) -> str:
+        self._load_model()
+        return self._device
+
+    @property
+    def model_loaded(self) -> bool:
+        return self._model is not None
+
     def _compute_hash(self, text: str) -> str:
         """Genera hash SHA256 truncado del texto."""
-        return hashlib.sha256(text.encode('utf-8')).hexdigest()[:self.hash_length]
+        return header_hash(text, self.hash_length)
 
     def _load_mappings(self) -> None:
-        """Carga mapeos desde archivo JSON si existe."""
-        if self.mappings_file.exists():
+        """Carga mapeos desde el registro o desde archivo JSON si existe."""
+        if self.registry is not None:
+            self.mappings = self.registry.to_dict()
+            logger.info(f"Cargados {len(self.mappings)} mapeos desde {self.registry.db_file}")
+        elif self.mappings_file is not None and self.mappings_file.exists():
             logger.info(f"Cargando mapeos desde {self.mappings_file}")
             with open(self.mappings_file, 'r', encoding='utf-8') as f:
                 self.mappings = json.load(f)
@@ -88,22 +167,16 @@ class HeaderStandardizer:
             self.mappings = {}
 
     def _save_mappings(self) -> None:
-        """Guarda mapeos actuales a archivo JSON."""
+        """Guarda mapeos actuales a archivo JSON (el registro se escribe en cada alta)."""
+        if self.registry is not None:
+            return
         logger.info(f"Guardando mapeos en {self.mappings_file}")
         with open(self.mappings_file, 'w', encoding='utf-8') as f:
             json.dump(self.mappings, f, indent=2, ensure_ascii=False)
         logger.info(f"Guardados {len(self.mappings)} mapeos")
 
-    def _generate_standard_name(self, original_header: str) -> str:
-        """
-        Genera nombre estandarizado usando LLM.
-
-        Args:
-            original_header: Encabezado original (potencialmente largo/complejo)
-
-        Returns:
-            Nombre estandarizado corto (máx 3-4 palabras en snake_case)
-        """
+    def _build_prompt(self, original_header: str) -> str:
+        """Prompt few-shot para un encabezado."""
         # Prompt más directo y simple
         prompt = f"""Simplifica este encabezado a 4-6 palabras en español, snake_case, sin tildes y uppercase:
                     Entrada: "Marca"
@@ -120,15 +193,52 @@ class HeaderStandardizer:
 
                     Entrada: "{original_header}"
                     Salida:"""
+        return prompt
 
-        logger.debug(f"Generando nombre para: {original_header[:50]}...")
+    def _clean_output(self, result: str, original_header: str) -> str:
+        """Convierte la salida del modelo en un nombre estándar válido."""
+        # Limpiar resultado
+        standard_name = result.strip().upper()
+        # Remover cualquier texto residual del prompt
+        standard_name = standard_name.split('\n')[0].split(':')[-1].strip()
+        # Convertir a snake_case válido
+        standard_name = ''.join(c if c.isalnum() or c == '_' else '_' for c in standard_name)
+        standard_name = '_'.join(filter(None, standard_name.split('_')))  # Eliminar _ duplicados
+
+        # Si el resultado está vacío o muy corto, usar fallback basado en hash
+        if len(standard_name) < 3:
+            logger.warning(f"Resultado vacío del LLM, usando fallback")
+            standard_name = f"col_{self._compute_hash(original_header)[:8]}"
+
+        logger.info(f"'{original_header[:40]}...' -> '{standard_name}'")
+        return standard_name
+
+    def _generate_standard_names(self, original_headers: List[str]) -> List[str]:
+        """
+        Genera nombres estandarizados para un lote de encabezados en una sola
+        llamada a `generate` (entradas con padding y attention mask).
+        Con decodificación greedy el resultado es el mismo que uno a uno.
+        """
+        if self.worker is not None:
+            try:
+                return self.worker.generate(original_headers)
+            except WorkerUnavailable as e:
+                # Sin worker se sigue con el modelo local (se carga al primer uso)
+                logger.warning(f"{e}; se usa el modelo local")
+                self.worker = None
+
+        import torch
+
+        prompts = [self._build_prompt(h) for h in original_headers]
+        logger.debug(f"Generando {len(prompts)} nombres en lote...")
 
         # Tokenizar
         inputs = self.tokenizer(
-            prompt,
+            prompts,
             return_tensors="pt",
             max_length=512,
-            truncation=True
+            truncation=True,
+            padding=True
         ).to(self.device)
 
         # Generar
@@ -142,23 +252,21 @@ class HeaderStandardizer:
             )
 
         # Decodificar
-        result = self.tokenizer.decode(outputs[0], skip_special_tokens=True)
+        results = self.tokenizer.batch_decode(outputs, skip_special_tokens=True)
+        return [self._clean_output(r, h) for r, h in zip(results, original_headers)]
 
-        # Limpiar resultado
-        standard_name = result.strip().upper()
-        # Remover cualquier texto residual del prompt
-        standard_name = standard_name.split('\n')[0].split(':')[-1].strip()
-        # Convertir a snake_case válido
-        standard_name = ''.join(c if c.isalnum() or c == '_' else '_' for c in standard_name)
-        standard_name = '_'.join(filter(None, standard_name.split('_')))  # Eliminar _ duplicados
+    def _generate_standard_name(self, original_header: str) -> str:
+        """
+        Genera nombre estandarizado usando LLM.
 
-        # Si el resultado está vacío o muy corto, usar fallback basado en hash
-        if len(standard_name) < 3:
-            logger.warning(f"Resultado vacío del LLM, usando fallback")
-            standard_name = f"col_{self._compute_hash(original_header)[:8]}"
+        Args:
+            original_header: Encabezado original (potencialmente largo/complejo)
 
-        logger.info(f"'{original_header[:40]}...' -> '{standard_name}'")
-        return standard_name
+        Returns:
+            Nombre estandarizado corto (máx 3-4 palabras en snake_case)
+        """
+        logger.debug(f"Generando nombre para: {original_header[:50]}...")
+        return self._generate_standard_names([original_header])[0]
 
     def standardize_header(self, original_header: str) -> str:
         """
@@ -173,49 +281,106 @@ class HeaderStandardizer:
         header_hash = self._compute_hash(original_header)
 
         # Buscar en caché por hash
-        for std_name, info in self.mappings.items():
-            if header_hash in info['hashes']:
-                logger.debug(f"Encontrado en caché: {std_name}")
-                return std_name
+        std_name = self._find_cached(header_hash)
+        if std_name is not None:
+            return std_name
 
         # No encontrado, generar nuevo
         logger.info(f"Encabezado nuevo detectado, generando nombre estándar...")
         standard_name = self._generate_standard_name(original_header)
 
-        # Evitar colisiones de nombres
+        # Evitar colisiones de nombres y almacenar en mappings
+        standard_name = self._register_name(standard_name, original_header, header_hash)
+
+        self._save_mappings()
+        return standard_name
+
+    def _find_cached(self, header_hash: str) -> Optional[str]:
+        """Busca el nombre estándar asociado a un hash en caché."""
+        if self.registry is not None:
+            return self.registry.lookup(header_hash)
+        for std_name, info in self.mappings.items():
+            if header_hash in info['hashes']:
+                logger.debug(f"Encontrado en caché: {std_name}")
+                return std_name
+        return None
+
+    def _register_name(self, standard_name: str, original_header: str, header_hash: str) -> str:
+        """Registra un nombre nuevo en los mapeos evitando colisiones (_1, _2, ...)."""
+        if self.registry is not None:
+            # Alta atómica: el registro resuelve colisiones frente a otros procesos
+            standard_name = self.registry.register(standard_name, original_header, header_hash)
+            info = self.mappings.setdefault(standard_name, {"original_names": [], "hashes": []})
+            if header_hash not in info["hashes"]:
+                info["original_names"].append(original_header)
+                info["hashes"].append(header_hash)
+            return standard_name
+
         base_name = standard_name
         counter = 1
         while standard_name in self.mappings:
             standard_name = f"{base_name}_{counter}"
             counter += 1
 
-        # Almacenar en mappings
         self.mappings[standard_name] = {
             "original_names": [original_header],
             "hashes": [header_hash],
             "created_at": str(Path(__file__).stat().st_mtime)
         }
-
-        self._save_mappings()
         return standard_name
 
-    def batch_standardize(self, headers: List[str]) -> Dict[str, str]:
+    def generate_in_batches(self, headers: List[str], batch_size: int = 8) -> Dict[str, str]:
+        """
+        Genera nombres (sin caché ni registro) para encabezados únicos, en
+        lotes de `batch_size` ordenados por largo para minimizar el padding.
+
+        Returns:
+            Diccionario {original: nombre generado}
+        """
+        logger.info(f"Generando {len(headers)} nombres en lotes de {batch_size}...")
+        generated = {}
+        pending = sorted(headers, key=len)
+        for i in range(0, len(pending), batch_size):
+            batch = pending[i:i + batch_size]
+            generated.update(zip(batch, self._generate_standard_names(batch)))
+        return generated
+
+    def batch_standardize(self, headers: List[str], batch_size: int = 8) -> Dict[str, str]:
         """
         Estandariza múltiples encabezados de una vez.
 
+        Los encabezados que no están en caché se pasan al modelo en lotes de
+        `batch_size`; luego se asignan los nombres en el orden de `headers`,
+        resolviendo colisiones igual que standardize_header.
+
         Args:
             headers: Lista de encabezados originales
+            batch_size: Encabezados por llamada a `generate`
 
         Returns:
             Diccionario {original: estandarizado}
         """
+        headers = list(headers)
         logger.info(f"Procesando batch de {len(headers)} encabezados...")
-        mapping = {}
+        hashes = [self._compute_hash(h) for h in headers]
+
+        # Encabezados nuevos (únicos, en orden de aparición)
+        misses = {}
+        for header, header_hash in zip(headers, hashes):
+            if header not in misses and self._find_cached(header_hash) is None:
+                misses[header] = header_hash
 
-        for header in headers:
-            std_name = self.standardize_header(header)
+        generated = self.generate_in_batches(list(misses), batch_size) if misses else {}
+
+        mapping = {}
+        for header, header_hash in zip(headers, hashes):
+            std_name = self._find_cached(header_hash)
+            if std_name is None:
+                std_name = self._register_name(generated[header], header, header_hash)
             mapping[header] = std_name
 
+        if generated:
+            self._save_mappings()
         logger.info(f"Batch completado: {len(mapping)} encabezados estandarizados")
         return mapping
 
@@ -6,17 +6,19 @@ Alternativa más confiable y rápida que LLM para casos predecibles
 # LIBRERÍAS
 #----------------------------
 import json
-import hashlib
 import logging
 import re
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from typing import Dict, List, Optional
-from unidecode import unidecode
 
 
 import os
 from dotenv import load_dotenv
 
+from header_registry import HeaderMappingRegistry, MAPPING_REGISTRY_DB, HASH_LENGTH, header_hash
+from text_normalization import fold_ascii
+
 #----------------------------
 # VARIABLES DE ENTORNO
 #----------------------------
@@ -37,6 +39,11 @@ logging.basicConfig(
 name_script = Path(__file__)
 logger = logging.getLogger(f"Estandarizador de Encabezados con Reglas - {name_script}")
 
+# Patrón de unidades con formato: letra+número?/letra+número? -> (g/km), km/h, km/kWh
+UNIT_PATTERN = re.compile(r"\(?\b([a-zA-Z]+\d*(?:/[a-zA-Z]+\d*)+)\b\)?")
+SNAKE_INVALID_PATTERN = re.compile(r'[^a-z0-9_]')
+SNAKE_UNDERSCORES_PATTERN = re.compile(r'_+')
+
 
 #----------------------------
 # INICIO CODIGO
@@ -51,10 +58,29 @@ class HeaderStandardizerRules:
     def __init__(
         self,
         mappings_file: str = MAPPING_HEADERS_FILE,
-        hash_length: int = 12,
-        maxlenHeader: int = 10
+        hash_length: int = HASH_LENGTH,
+        maxlenHeader: int = 10,
+        registry: Optional[HeaderMappingRegistry] = None
     ):
-        self.mappings_file = Path(mappings_file)
+        """
+        Args:
+            mappings_file: Archivo JSON para persistir mapeos (si no hay registro)
+            hash_length: Longitud del hash (caracteres); con registro debe ser HASH_LENGTH
+            maxlenHeader: Máximo de términos del nombre estándar
+            registry: Registro SQLite compartido. Por defecto se usa el definido
+                en MAPPING_REGISTRY_DB, si existe; si no, el archivo JSON. Al
+                abrirlo se migra `mappings_file` la primera vez (import_json_once).
+        """
+        if registry is None and MAPPING_REGISTRY_DB:
+            registry = HeaderMappingRegistry(MAPPING_REGISTRY_DB)
+        if registry is not None and hash_length != HASH_LENGTH:
+            raise ValueError(f"El registro compartido usa hashes de {HASH_LENGTH} caracteres "
+                             f"(HASH_LENGHT), no {hash_length}.")
+        if registry is not None:
+            # Sin esto el primer uso del registro partiría vacío y perdería los mapeos JSON
+            registry.import_json_once(mappings_file)
+        self.registry = registry
+        self.mappings_file = Path(mappings_file) if mappings_file else None
         self.hash_length = hash_length
         self.mappings: Dict[str, Dict] = {}
         self.maxlenHeader = maxlenHeader
@@ -152,8 +178,16 @@ class HeaderStandardizerRules:
         }
 
         # estandarización de abreviaciones:
-        self.abbreviations = {unidecode(kw):w for kw,w in self.abbreviations.items()}
-        self.special_abbreviations = {unidecode(kw):w for kw,w in self.special_abbreviations.items()}
+        self.abbreviations = {fold_ascii(kw):w for kw,w in self.abbreviations.items()}
+        self.special_abbreviations = {fold_ascii(kw):w for kw,w in self.special_abbreviations.items()}
+
+        # Palabras a ignorar (stopwords en español)
+        self.stopwords = {
+            'de', 'del', 'la', 'el', 'los', 'las', 'un', 'una', 'y', 'o',
+            'en', 'con', 'sin', 'por', 'para', 'a', 'al', 'se', 'su',
+            'que', 'es', 'son', 'esta', 'este', 'mediante', 'segun','nonies',
+            'ciclo','condicion','puro','entre'
+        }
 
         # Patrones a eliminar
         self.remove_patterns = [
@@ -167,16 +201,52 @@ class HeaderStandardizerRules:
             r'[\.\,]' #puntos y comas
         ]
 
+        self._compile_patterns()
         self._load_mappings()
         logger.info(f"{name_script} inicializado")
 
+    def _compile_patterns(self) -> None:
+        """
+        Compila una sola vez las expresiones usadas en cada encabezado:
+        patrones a eliminar, abreviaciones especiales y unidades conocidas
+        se unen en alternancias para recorrer el texto en una sola pasada.
+        """
+        self._remove_regex = re.compile('|'.join(f'(?:{p})' for p in self.remove_patterns))
+        # Una alternancia reemplaza en una pasada y toma el calce más a la izquierda;
+        # el replace secuencial original aplicaba cada clave en orden del diccionario
+        # y podía encadenar reemplazos. Ambos dan lo mismo solo si ninguna clave es
+        # subcadena de otra clave ni de un reemplazo (se valida aquí) y si las claves
+        # que se solapan ('con autopista'/'autopista interurbana') siguen en el
+        # diccionario el orden en que aparecen en el texto.
+        self._check_special_abbreviations()
+        keywords = [re.escape(kw) for kw in self.special_abbreviations if kw]
+        # Sin abreviaciones no hay regex: un patrón vacío calzaría en cada posición
+        self._special_regex = re.compile('|'.join(keywords)) if keywords else None
+        # Unidades más largas primero para que 'kmh' no quede tapada por 'km'
+        units = sorted(self.measure_units, key=len, reverse=True)
+        self._units_regex = re.compile(rf"\b({'|'.join(re.escape(u) for u in units)})\b")
+
+    def _check_special_abbreviations(self) -> None:
+        """Falla si una abreviación especial contiene a otra clave o queda dentro de un reemplazo."""
+        keys = [kw for kw in self.special_abbreviations if kw]
+        for kw in keys:
+            containers = [other for other in keys if other != kw and kw in other]
+            containers += [f"{other} -> {repl}" for other, repl in self.special_abbreviations.items()
+                           if kw in repl]
+            if containers:
+                raise ValueError(f"Abreviación especial '{kw}' contenida en: {containers}. "
+                                 "Con la regex combinada el resultado dependería del orden de reemplazo.")
+
     def _compute_hash(self, text: str) -> str:
         """Genera hash SHA256 truncado del texto."""
-        return hashlib.sha256(text.encode('utf-8')).hexdigest()[:self.hash_length]
+        return header_hash(text, self.hash_length)
 
     def _load_mappings(self) -> None:
-        """Carga mapeos desde archivo JSON si existe."""
-        if self.mappings_file.exists():
+        """Carga mapeos desde el registro o desde archivo JSON si existe."""
+        if self.registry is not None:
+            self.mappings = self.registry.to_dict()
+            logger.info(f"Cargados {len(self.mappings)} mapeos desde {self.registry.db_file}")
+        elif self.mappings_file is not None and self.mappings_file.exists():
             logger.info(f"Cargando mapeos desde {self.mappings_file}")
             with open(self.mappings_file, 'r', encoding='utf-8') as f:
                 self.mappings = json.load(f)
@@ -186,7 +256,9 @@ class HeaderStandardizerRules:
             self.mappings = {}
 
     def _save_mappings(self) -> None:
-        """Guarda mapeos actuales a archivo JSON."""
+        """Guarda mapeos actuales a archivo JSON (el registro se escribe en cada alta)."""
+        if self.registry is not None:
+            return
         logger.info(f"Guardando mapeos en {self.mappings_file}")
         with open(self.mappings_file, 'w', encoding='utf-8') as f:
             json.dump(self.mappings, f, indent=2, ensure_ascii=False)
@@ -203,10 +275,9 @@ class HeaderStandardizerRules:
         # Convertir a minúsculas
         text = text.lower()
         # Remover patrones no deseados
-        for pattern in self.remove_patterns:
-            text = re.sub(pattern, ' ', text)
+        text = self._remove_regex.sub(' ', text)
         # Remover tildes y caracteres especiales
-        text = unidecode(text)
+        text = fold_ascii(text)
         # Limpiar espacios
         text = ' '.join(text.split())
         return text
@@ -215,8 +286,8 @@ class HeaderStandardizerRules:
         """
         Aplica abreviaciones conocidas del dominio. Y significados especiales
         """
-        for word, abbrev in self.special_abbreviations.items():
-            text = text.replace(word,abbrev)
+        if self._special_regex is not None:
+            text = self._special_regex.sub(lambda m: self.special_abbreviations[m.group(0)], text)
 
         words = text.split()
         abbreviated = []
@@ -237,11 +308,8 @@ class HeaderStandardizerRules:
         Returns:
             Unidad normalizada sin separadores o None si no hay
         """
-        # Patrón para unidades con formato: letra+número?/letra+número?
         # Captura: (g/km), km/h, kWh, km/kWh, etc.
-        pattern = r"\(?\b([a-zA-Z]+\d*(?:/[a-zA-Z]+\d*)+)\b\)?"
-
-        match = re.search(pattern, text)
+        match = UNIT_PATTERN.search(text)
         if match:
             unit = match.group(1).lower()
             # Normalizar: remover separadores
@@ -249,11 +317,13 @@ class HeaderStandardizerRules:
             logger.debug(f"Unidad encontrada por patrón: {unit} -> {unit_normalized}")
             return unit_normalized
 
-        # Buscar en lista de unidades conocidas
-        text_lower = text.lower()
+        # Buscar en lista de unidades conocidas (como palabra completa)
+        found = set(self._units_regex.findall(text.lower()))
+        if not found:
+            return None
+        # Se respeta el orden de recorrido de measure_units
         for unit in self.measure_units:
-            # Buscar la unidad como palabra completa
-            if re.search(rf'\b{unit}\b', text_lower):
+            if unit in found:
                 logger.debug(f"Unidad encontrada en lista: {unit}")
                 return unit
         return None
@@ -274,13 +344,7 @@ class HeaderStandardizerRules:
         Returns:
             Lista ordenada de términos clave (max max_terms elementos)
         """
-        # Palabras a ignorar (stopwords en español)
-        stopwords = {
-            'de', 'del', 'la', 'el', 'los', 'las', 'un', 'una', 'y', 'o',
-            'en', 'con', 'sin', 'por', 'para', 'a', 'al', 'se', 'su',
-            'que', 'es', 'son', 'esta', 'este', 'mediante', 'segun','nonies',
-            'ciclo','condicion','puro','entre'
-        }
+        stopwords = self.stopwords
 
         words = text.split()
 
@@ -319,9 +383,9 @@ class HeaderStandardizerRules:
         #snake = '_'.join(words)
         snake = '_'.join(f"{wd}" for wd in dict.fromkeys(words)) # dict.fromkeys(words) es un set pero con orden.
         # Asegurar solo caracteres válidos
-        snake = re.sub(r'[^a-z0-9_]', '_', snake)
+        snake = SNAKE_INVALID_PATTERN.sub('_', snake)
         # Eliminar underscores múltiples
-        snake = re.sub(r'_+', '_', snake)
+        snake = SNAKE_UNDERSCORES_PATTERN.sub('_', snake)
         # Eliminar underscores al inicio/final
         snake = snake.strip('_')
 
@@ -339,8 +403,7 @@ class HeaderStandardizerRules:
         # Paso 2: Extraer unidad ANTES de procesar (para no perderla)
         measure_unit = self._extract_measure_unit(original_header)
         if measure_unit:
-            pattern = r"\(?\b([a-zA-Z]+\d*(?:/[a-zA-Z]+\d*)+)\b\)?"
-            normalized = re.sub(pattern,'',normalized)
+            normalized = UNIT_PATTERN.sub('', normalized)
 
         # Paso 3: Aplicar abreviaciones
         abbreviated = self._apply_abbreviations(normalized)
@@ -364,50 +427,169 @@ class HeaderStandardizerRules:
         logger.info(f"'{original_header[:40]}...' -> '{standard_name}'")
         return standard_name.upper() #nombre estandarizado en uppercase
 
-    def standardize_header(self, original_header: str) -> str:
+    def known_terms(self) -> set:
         """
-        Estandariza un encabezado. Usa caché si existe.
+        Vocabulario de los diccionarios generales de las reglas: abreviaciones,
+        términos prioritarios, unidades y stopwords. No incluye los nombres
+        registrados ni los del archivo de mapeos.
         """
-        header_hash = self._compute_hash(original_header)
-
-        # Buscar en caché
+        terms = set(self.priority_terms) | set(self.measure_units) | set(self.stopwords)
+        terms |= set(self.abbreviations) | set(self.abbreviations.values())
+        for abbrev in self.special_abbreviations.values():
+            terms.update(abbrev.split())
+        terms.discard('')
+        return terms
+
+    def score_confidence(self, standard_name: str, known_terms: Optional[set] = None,
+                         min_length: int = 4, unknown_weight: float = 0.3,
+                         fragment_length: int = 2) -> float:
+        """
+        Confianza (0 a 1) de un nombre generado por las reglas.
+
+        - Fallback por hash (COL_xxxxxxxx): 0
+        - Términos fuera de known_terms (y no numéricos) descuentan
+          `unknown_weight` por su proporción: un campo nuevo con palabras
+          correctas (NUMERO_PUERTAS) queda en 0.7
+        - Un término desconocido de hasta `fragment_length` caracteres (la 'p'
+          o 'ky' que deja un typo) descuenta como término errado
+        - Nombres más cortos que `min_length` se penalizan a la mitad
+
+        Con el umbral 0.6 de HeaderStandardizerCascade van al LLM los fallback
+        por hash, los nombres cortos y los que tienen fragmentos. Medido con
+        benchmark_matchers.confidence_report (5 variantes, seed 0), ningún
+        nombre correcto va al LLM: 0/204 de las etiquetas reservadas y 0/25 de
+        los encabezados fuera del catálogo. Tampoco van los 96 incorrectos de
+        las reservadas: son typos dentro de palabras largas, que sin un
+        vocabulario del dominio no se distinguen de una palabra nueva.
+        """
+        if standard_name.upper().startswith("COL_"):
+            return 0.0
+        terms = [t for t in standard_name.lower().split('_') if t]
+        if not terms:
+            return 0.0
+        if known_terms is None:
+            known_terms = self.known_terms()
+        unknown = [t for t in terms if not t.isdigit() and t not in known_terms]
+        fragments = sum(1 for t in unknown if len(t) <= fragment_length)
+        confidence = 1.0 - (unknown_weight * (len(unknown) - fragments) + fragments) / len(terms)
+        if len(standard_name) < min_length:
+            confidence *= 0.5
+        return max(confidence, 0.0)
+
+    def _find_cached(self, header_hash: str) -> Optional[str]:
+        """Busca el nombre estándar asociado a un hash en caché."""
+        if self.registry is not None:
+            return self.registry.lookup(header_hash)
         for std_name, info in self.mappings.items():
             if header_hash in info['hashes']:
                 logger.debug(f"Encontrado en caché: {std_name}")
                 return std_name
+        return None
 
-        # Generar nuevo
-        logger.info(f"Generando nuevo nombre estándar...")
-        standard_name = self._generate_standard_name(original_header)
+    def _register_name(self, standard_name: str, original_header: str, header_hash: str) -> str:
+        """
+        Registra un nombre nuevo en los mapeos evitando colisiones (_1, _2, ...).
+        """
+        if self.registry is not None:
+            # Alta atómica: el registro resuelve colisiones frente a otros procesos
+            standard_name = self.registry.register(standard_name, original_header, header_hash)
+            info = self.mappings.setdefault(standard_name, {"original_names": [], "hashes": []})
+            if header_hash not in info["hashes"]:
+                info["original_names"].append(original_header)
+                info["hashes"].append(header_hash)
+            return standard_name
 
-        # Evitar colisiones
         base_name = standard_name
         counter = 1
         while standard_name in self.mappings:
             standard_name = f"{base_name}_{counter}"
             counter += 1
 
-        # Almacenar
         self.mappings[standard_name] = {
             "original_names": [original_header],
             "hashes": [header_hash]
         }
+        return standard_name
+
+    def standardize_header(self, original_header: str) -> str:
+        """
+        Estandariza un encabezado. Usa caché si existe.
+        """
+        header_hash = self._compute_hash(original_header)
+
+        # Buscar en caché
+        std_name = self._find_cached(header_hash)
+        if std_name is not None:
+            return std_name
+
+        # Generar nuevo
+        logger.info(f"Generando nuevo nombre estándar...")
+        standard_name = self._generate_standard_name(original_header)
+
+        # Evitar colisiones y almacenar
+        standard_name = self._register_name(standard_name, original_header, header_hash)
 
         self._save_mappings()
         return standard_name
 
-    def batch_standardize(self, headers: List[str]) -> Dict[str, str]:
+    def batch_standardize(self, headers: List[str], n_workers: int = 1) -> Dict[str, str]:
         """
         Estandariza múltiples encabezados.
+
+        Args:
+            headers: Lista de encabezados originales
+            n_workers: Procesos para normalizar los encabezados nuevos. Con 1 se
+                procesa en serie; con más, los nombres se generan en paralelo y
+                luego se asignan en orden, resolviendo colisiones igual que en serie.
         """
+        headers = list(headers)
         logger.info(f"Procesando batch de {len(headers)} encabezados...")
-        mapping = {}
+        if n_workers > 1:
+            mapping = self._batch_standardize_parallel(headers, n_workers)
+        else:
+            mapping = {}
+            for header in headers:
+                std_name = self.standardize_header(header)
+                mapping[header] = std_name
+
+        logger.info(f"Batch completado")
+        return mapping
 
-        for header in headers:
-            std_name = self.standardize_header(header)
+    def _batch_standardize_parallel(self, headers: List[str], n_workers: int) -> Dict[str, str]:
+        """
+        Genera en un pool de procesos los nombres de los encabezados no cacheados
+        y los fusiona en un solo paso determinista, en el orden de `headers`.
+        """
+        hashes = [self._compute_hash(h) for h in headers]
+
+        # Encabezados nuevos (únicos, en orden de aparición)
+        misses = {}
+        for header, header_hash in zip(headers, hashes):
+            if header not in misses and self._find_cached(header_hash) is None:
+                misses[header] = header_hash
+
+        generated = {}
+        if misses:
+            logger.info(f"Generando {len(misses)} nombres con {n_workers} procesos...")
+            chunksize = max(1, len(misses) // (4 * n_workers))
+            with ProcessPoolExecutor(
+                max_workers=n_workers,
+                initializer=_init_worker,
+                initargs=(self,),
+            ) as executor:
+                names = executor.map(_worker_generate_name, misses, chunksize=chunksize)
+                generated = dict(zip(misses, names))
+
+        # Fusión determinista: mismo orden y colisiones que la versión serial
+        mapping = {}
+        for header, header_hash in zip(headers, hashes):
+            std_name = self._find_cached(header_hash)
+            if std_name is None:
+                std_name = self._register_name(generated[header], header, header_hash)
             mapping[header] = std_name
 
-        logger.info(f"Batch completado")
+        if generated:
+            self._save_mappings()
         return mapping
 
     def export_to_csv(self, output_file: str = "header_mappings.csv") -> None:
@@ -428,6 +610,17 @@ class HeaderStandardizerRules:
         logger.info(f"Mapeos exportados a {output_file}")
 
 
+# Estandarizador de cada proceso del pool (se copia una vez por proceso)
+_worker_standardizer: Optional[HeaderStandardizerRules] = None
+
+def _init_worker(standardizer: HeaderStandardizerRules) -> None:
+    global _worker_standardizer
+    _worker_standardizer = standardizer
+
+def _worker_generate_name(original_header: str) -> str:
+    return _worker_standardizer._generate_standard_name(original_header)
+
+
 def main():
     """Demo con encabezados de ejemplo."""
 
@@ -1,7 +1,11 @@
 import re
+import json
+import hashlib
 import pandas as pd
 
 from difflib import SequenceMatcher
+from text_normalization import WHITESPACE, fold_ascii
+from memory_budget import check_budget
 import numpy as np
 from typing import Tuple, Optional, Dict, List
 
@@ -23,6 +27,7 @@ RAWDATANAME = os.getenv("RAWDATANAME", "dataRawHom")
 HASH_LENGHT = os.getenv("HASH_LENGHT")
 FILETMPNAME = os.getenv("FILETMPNAME","campos_hom_tmp")
 BD_IMPORTADORES = os.getenv("BD_IMPORTADORES")
+IMPORTER_CACHE_FILE = os.getenv("IMPORTER_CACHE_FILE", f"{FOLDER_PROCESSED}cache_importadores.json")
 
 # Configuración básica para .log
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
@@ -34,21 +39,126 @@ logging.basicConfig(
 #----------------------------
 # FUNCIONES
 #----------------------------
+# Caracteres que se eliminan del nombre normalizado
+_NAME_DELETE = str.maketrans("", "", WHITESPACE + ".-")
+
 def normalize_name(text: str) -> str:
-    """Normaliza nombres para comparación difusa."""
+    """Normaliza nombres para comparación difusa (ASCII, mayúsculas, sin espacios ni puntuación)."""
     if pd.isna(text):
         return ""
-    text = str(text).upper()
-    text = re.sub(r"[\t\.\-\s]+", "", text)
-    return text
+    return fold_ascii(str(text)).upper().translate(_NAME_DELETE)
+
+def junk_char(ch: str) -> bool:
+    """Caracteres ignorados por el scoring original (standarize_importers_old)."""
+    return ch in ["\t",".", " ","-"]
 
 def prepare_catalog(bd_imp: pd.DataFrame) -> pd.DataFrame:
     """Prepara base maestra agregando versión normalizada."""
-    catalog = bd_imp.copy()
+    catalog = bd_imp.copy(deep=False)
     catalog["_norm"] = catalog["NOMBRE_EMP"].map(normalize_name)
     return catalog
 
 
+def name_trigrams(norm: str) -> set:
+    """Trigramas de un nombre ya normalizado (con bordes para nombres cortos)."""
+    norm = f"  {norm} "
+    return {norm[i:i+3] for i in range(len(norm) - 2)}
+
+
+def block_keys(raw_name: str) -> set:
+    """
+    Claves de bloqueo de un nombre: trigramas del nombre normalizado y prefijos
+    de 4 letras de cada palabra (comparables con NOMBRE_COD del catálogo).
+    """
+    keys = name_trigrams(normalize_name(raw_name))
+    if not pd.isna(raw_name):
+        keys |= {f"COD:{w[:4]}" for w in re.split(r"[\s\.\-]+", str(raw_name).upper()) if w}
+    return keys
+
+
+def build_match_index(
+    candidates: np.ndarray,
+    codes: Optional[np.ndarray] = None,
+) -> dict:
+    """
+    Índice para búsqueda difusa sobre los nombres del catálogo.
+
+    - exact: {nombre normalizado: primer índice} para el camino rápido exacto
+    - postings: {clave de bloqueo: índices} (trigramas y NOMBRE_COD)
+
+    Args:
+        candidates: Nombres con los que se calcula el score (en el orden del catálogo)
+        codes: NOMBRE_COD de cada nombre (opcional)
+    """
+    exact = {}
+    postings: Dict[str, list] = {}
+    for i, name in enumerate(candidates):
+        exact.setdefault(normalize_name(name), i)
+        keys = name_trigrams(normalize_name(name))
+        if codes is not None and not pd.isna(codes[i]):
+            keys.add(f"COD:{str(codes[i]).upper()}")
+        for key in keys:
+            postings.setdefault(key, []).append(i)
+    return {
+        "candidates": [str(c) for c in candidates],
+        "exact": exact,
+        "postings": {k: np.array(v, dtype=np.int64) for k, v in postings.items()},
+    }
+
+
+def find_best_match_indexed(
+    raw_name: str,
+    index: dict,
+    threshold: float,
+    query: Optional[str] = None,
+    isjunk=None,
+) -> Tuple[Optional[int], float]:
+    """
+    Igual que find_best_match, pero usando el índice de build_match_index:
+
+    1. Camino rápido: nombre normalizado idéntico -> score 1.0
+    2. Bloqueo: solo se puntúan nombres que comparten claves con raw_name
+       (si no comparte ninguna, se recorre todo el catálogo)
+    3. Poda: real_quick_ratio / quick_ratio son cotas superiores de ratio y
+       descartan candidatos que no pueden superar al mejor encontrado
+
+    Args:
+        query: Texto a comparar (por defecto, el nombre normalizado)
+        isjunk: Función de basura para SequenceMatcher
+    """
+    norm_raw = normalize_name(raw_name)
+    candidates = index["candidates"]
+    exact_idx = index["exact"].get(norm_raw)
+    if exact_idx is not None and query is None:
+        return exact_idx, 1.0
+    query = norm_raw if query is None else query
+
+    # Conteo vectorizado de claves compartidas por candidato
+    postings = [index["postings"][k] for k in block_keys(raw_name) if k in index["postings"]]
+    if postings:
+        hits = np.bincount(np.concatenate(postings), minlength=len(candidates))
+        # Más claves compartidas primero; a igualdad, orden del catálogo
+        order = np.lexsort((np.arange(len(candidates)), -hits))
+        order = order[hits[order] > 0]
+    else:
+        order = np.arange(len(candidates))
+
+    best_idx, best_score = None, -1.0
+    for i in order:
+        sm = SequenceMatcher(isjunk, query, candidates[i])
+        if sm.real_quick_ratio() < best_score or sm.quick_ratio() < best_score:
+            continue
+        score = sm.ratio()
+        # A igualdad de score gana el primero del catálogo (como argmax)
+        if score > best_score or (score == best_score and i < best_idx):
+            best_idx, best_score = int(i), score
+
+    if best_score >= threshold:
+        return best_idx, best_score
+
+    return None, best_score
+
+
 def find_best_match(
     raw_name: str,
     catalog_norm_names: np.ndarray,
@@ -74,30 +184,95 @@ def find_best_match(
     return None, best_score
 
 
+def catalog_hash(bd_imp: pd.DataFrame) -> str:
+    """Hash del contenido del catálogo de importadores (invalida la caché si cambia)."""
+    values = pd.util.hash_pandas_object(bd_imp, index=False).to_numpy()
+    header = "|".join(map(str, bd_imp.columns)).encode()
+    return hashlib.sha256(header + values.tobytes()).hexdigest()
+
+
+def load_importer_catalog() -> pd.DataFrame:
+    """Catálogo de importadores (FOLDER_PROCESSED/BD_IMPORTADORES.csv)."""
+    logging.info("Lectura de base de datos de importadores")
+    return pd.read_csv(f"{FOLDER_PROCESSED}{BD_IMPORTADORES}.csv")
+
+
+def load_importer_cache(cache_file: Optional[str], cat_hash: str, matcher: str) -> Dict[str, dict]:
+    """
+    Lee la caché persistente {nombre crudo: mejor match} de un matcher.
+    Si el catálogo cambió (otro hash) la caché se descarta.
+    """
+    if not cache_file or not Path(cache_file).exists():
+        return {}
+    with open(cache_file, "r", encoding="utf-8") as f:
+        cache = json.load(f)
+    if cache.get("catalog_hash") != cat_hash:
+        logging.info("Catálogo de importadores modificado: se descarta la caché")
+        return {}
+    return cache.get("matchers", {}).get(matcher, {})
+
+
+def save_importer_cache(cache_file: Optional[str], cat_hash: str, matcher: str,
+                        entries: Dict[str, dict]) -> None:
+    """Guarda la caché de un matcher (escritura atómica con archivo temporal)."""
+    if not cache_file:
+        return
+    cache = {"catalog_hash": cat_hash, "matchers": {}}
+    if Path(cache_file).exists():
+        with open(cache_file, "r", encoding="utf-8") as f:
+            previous = json.load(f)
+        if previous.get("catalog_hash") == cat_hash:
+            cache = previous
+    cache["matchers"][matcher] = entries
+    tmpfile = f"{cache_file}.{os.getpid()}.tmp"
+    with open(tmpfile, "w", encoding="utf-8") as f:
+        json.dump(cache, f, indent=2, ensure_ascii=False)
+    os.replace(tmpfile, cache_file)
+    logging.info("Caché de importadores guardada en: %s", cache_file)
+
+
 def build_importer_mapping(
     data: pd.DataFrame,
     catalog: pd.DataFrame,
     threshold: float,
+    cache: Optional[Dict[str, dict]] = None,
 ) -> Tuple[Dict[str, dict], List[str]]:
     """
     Genera diccionario de equivalencias:
     nombre_original -> datos estandarizados
+
+    `cache` ({nombre crudo: mejor match}) se consulta y se completa con los
+    nombres nuevos; guarda el mejor match aunque no supere threshold.
     """
     unique_names = data["IMPORTADOR"].dropna().unique()
-    catalog_norm = catalog["_norm"].to_numpy()
+    cache = {} if cache is None else cache
+    index = None
 
     mapping = {}
     not_found = []
 
     for name in unique_names:
-        idx, score = find_best_match(name, catalog_norm, threshold)
-
-        if idx is not None:
+        entry = cache.get(str(name))
+        if entry is None:
+            # Solo los nombres nuevos llegan al matcher difuso
+            if index is None:
+                codes = catalog["NOMBRE_COD"].to_numpy() if "NOMBRE_COD" in catalog else None
+                index = build_match_index(catalog["_norm"].to_numpy(), codes)
+            idx, score = find_best_match_indexed(name, index, threshold=0.0)
             row = catalog.iloc[idx]
-            mapping[name] = {
-                "IMPORTADOR_STD": row["NOMBRE_EMP"],
+            entry = {
+                "NOMBRE_EMP": row["NOMBRE_EMP"],
                 "RUT": row["RUT"],
-                "IMP_COD": row["COD_IMP"],
+                "COD_IMP": row["COD_IMP"],
+                "score": float(score),
+            }
+            cache[str(name)] = entry
+
+        if entry["score"] >= threshold:
+            mapping[name] = {
+                "IMPORTADOR_STD": entry["NOMBRE_EMP"],
+                "RUT": entry["RUT"],
+                "IMP_COD": entry["COD_IMP"],
             }
         else:
             not_found.append(name)
@@ -109,15 +284,14 @@ def apply_importer_mapping(
     data: pd.DataFrame,
     mapping: Dict[str, dict],
 ) -> pd.DataFrame:
-    """Aplica equivalencias al DataFrame original."""
-    df = data.copy()
-
+    """Aplica equivalencias al DataFrame original (sin modificarlo)."""
     if not mapping:
-        return df
+        return data.copy(deep=False)
 
     map_df = pd.DataFrame.from_dict(mapping, orient="index")
 
-    df = df.join(map_df, on="IMPORTADOR")
+    # join ya entrega un DataFrame nuevo: no hace falta copiar `data` antes
+    df = data.join(map_df, on="IMPORTADOR")
 
     df["IMPORTADOR"] = df["IMPORTADOR_STD"].fillna(df["IMPORTADOR"])
     df.drop(columns=["IMPORTADOR_STD"], inplace=True)
@@ -129,6 +303,7 @@ def standarize_importers(
     data: pd.DataFrame,
     bd_imp: pd.DataFrame,
     threshold: float = 0.6,
+    cache_file: Optional[str] = IMPORTER_CACHE_FILE,
 ) -> Tuple[pd.DataFrame, List[str]]:
     """
     Orquesta proceso completo de estandarización de importadores.
@@ -136,9 +311,14 @@ def standarize_importers(
 
     logging.info("Preparando catálogo de importadores")
     catalog = prepare_catalog(bd_imp)
+    cat_hash = catalog_hash(bd_imp)
+    cache = load_importer_cache(cache_file, cat_hash, "normalized_ascii")
+    n_cached = len(cache)
 
     logging.info("Construyendo tabla de equivalencias")
-    mapping, not_found = build_importer_mapping(data, catalog, threshold)
+    mapping, not_found = build_importer_mapping(data, catalog, threshold, cache)
+    if len(cache) > n_cached:
+        save_importer_cache(cache_file, cat_hash, "normalized_ascii", cache)
 
     logging.info("Aplicando estandarización al dataset")
     df_std = apply_importer_mapping(data, mapping)
@@ -149,32 +329,104 @@ def standarize_importers(
 
 
 
-def standarize_importers_old(data: pd.DataFrame) -> pd.DataFrame:
+def resolve_importers_old(
+    imp_datanames: np.ndarray,
+    bd_imp: pd.DataFrame,
+    cache_file: Optional[str] = IMPORTER_CACHE_FILE,
+) -> Dict[str, dict]:
+    """
+    Mejor match del catálogo para cada nombre de importador (scoring original:
+    texto crudo y caracteres basura). Usa la caché persistente por hash de catálogo.
+
+    Returns:
+        {str(nombre): {"NOMBRE_EMP", "RUT", "COD_IMP", "score"}}
+    """
+    imp_stndnames = bd_imp['NOMBRE_EMP'].unique()
+
+    # Caché persistente: solo los nombres no vistos pasan por el matcher difuso
+    cat_hash = catalog_hash(bd_imp)
+    cache = load_importer_cache(cache_file, cat_hash, "old")
+    n_cached = len(cache)
+    index = None
+
+    for name in imp_datanames:
+        if str(name) in cache:
+            continue
+        check_budget()
+        if index is None:
+            codes = bd_imp.drop_duplicates('NOMBRE_EMP')['NOMBRE_COD'].to_numpy() if 'NOMBRE_COD' in bd_imp else None
+            index = build_match_index(imp_stndnames, codes)
+        ix, rat = find_best_match_indexed(name, index, threshold=0.0, query=str(name), isjunk=junk_char)
+        stdname = imp_stndnames[ix]
+        df = bd_imp[bd_imp['NOMBRE_EMP']==stdname]
+        cache[str(name)] = {
+            "NOMBRE_EMP": stdname,
+            "RUT": df['RUT'].unique()[0],
+            "COD_IMP": df['COD_IMP'].unique()[0],
+            "score": float(rat),
+        }
+    if len(cache) > n_cached:
+        save_importer_cache(cache_file, cat_hash, "old", cache)
+    return cache
+
+
+def standarize_importers_old(data: pd.DataFrame,
+                             cache_file: Optional[str] = IMPORTER_CACHE_FILE) -> pd.DataFrame:
     logging.info("Estandarización de nombres de Importadores")
     filename = f"{FOLDER_PROCESSED}{BD_IMPORTADORES}.csv"
     logging.info("Lectura de base de datos de importadores")
     bd_imp = pd.read_csv(filename)
-    data = data.copy()
+    # Copia superficial: con copy-on-write las escrituras no alcanzan al original
+    data = data.copy(deep=False)
 
     # nombres de importadores
     imp_datanames = data['IMPORTADOR'].unique()
-    imp_stndnames = bd_imp['NOMBRE_EMP'].unique()
+    resolved = resolve_importers_old(imp_datanames, bd_imp, cache_file)
 
-    #print(imp_stndnames)
-    score = []
     imp_not_found = []
     for name in imp_datanames:
-        rat = [SequenceMatcher(lambda x: x in ["\t","."," ","-"],str(name),str(n)).ratio() for n in imp_stndnames]
-        ix = np.argmax(rat)
-        stdname = imp_stndnames[ix]
-        df = bd_imp[bd_imp['NOMBRE_EMP']==stdname]
-        score.append(np.max(rat))
-        if np.max(rat)>0.6:
-            data.loc[data['IMPORTADOR']==name,'RUT'] = df['RUT'].unique()[0]
-            data.loc[data['IMPORTADOR']==name,'IMP_COD'] = df['COD_IMP'].unique()[0]
-            data.loc[data['IMPORTADOR']==name,'IMPORTADOR'] = stdname
+        entry = resolved[str(name)]
+        if entry["score"]>0.6:
+            data.loc[data['IMPORTADOR']==name,'RUT'] = entry["RUT"]
+            data.loc[data['IMPORTADOR']==name,'IMP_COD'] = entry["COD_IMP"]
+            data.loc[data['IMPORTADOR']==name,'IMPORTADOR'] = entry["NOMBRE_EMP"]
         else:
             imp_not_found.append(name)
             data.loc[data['IMPORTADOR']==name,'IMPORTADOR'] = name
     logging.info("Estandarización de importadores completada con éxito")
     return [data,imp_not_found]
+
+
+def standarize_importers_join(data: pd.DataFrame,
+                              cache_file: Optional[str] = IMPORTER_CACHE_FILE,
+                              threshold: float = 0.6) -> list:
+    """
+    Mismo resultado que standarize_importers_old, pero en una sola pasada:
+    IMPORTADOR se factoriza en códigos, se resuelve cada valor único una vez y
+    IMPORTADOR, RUT e IMP_COD se llenan con un gather por código.
+
+    Modifica `data` en su lugar (sin copiar el DataFrame) y lo retorna.
+    """
+    logging.info("Estandarización de nombres de Importadores")
+    bd_imp = load_importer_catalog()
+
+    imp_datanames = data['IMPORTADOR'].unique()
+    resolved = resolve_importers_old(imp_datanames, bd_imp, cache_file)
+    imp_not_found = [name for name in imp_datanames if resolved[str(name)]["score"] <= threshold]
+
+    # Códigos por fila; los nulos (-1) apuntan a la última posición: "sin match"
+    codes, uniques = pd.factorize(data['IMPORTADOR'])
+    entries = [resolved[str(name)] for name in uniques]
+    matched = np.array([e["score"] > threshold for e in entries] + [False])
+    std_names = np.array([e["NOMBRE_EMP"] for e in entries] + [None], dtype=object)
+    ruts = np.array([e["RUT"] for e in entries] + [np.nan], dtype=object)
+    imp_cods = np.array([e["COD_IMP"] for e in entries] + [np.nan], dtype=object)
+
+    row_matched = matched[codes]
+    for col, values in (('RUT', ruts), ('IMP_COD', imp_cods)):
+        current = data[col].to_numpy(dtype=object) if col in data else np.full(len(data), np.nan, dtype=object)
+        data[col] = np.where(row_matched, values[codes], current)
+    data['IMPORTADOR'] = np.where(row_matched, std_names[codes], data['IMPORTADOR'].to_numpy(dtype=object))
+
+    logging.info("Estandarización de importadores completada con éxito")
+    return [data,imp_not_found]
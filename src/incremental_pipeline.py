@@ -0,0 +1,205 @@
+"""
+Transformación incremental por hash de contenido de fila
+Cada versión del libro del 3CV es casi siempre la anterior más homologaciones
+nuevas. Este modo transforma solo las filas nuevas o modificadas y las une al
+resultado guardado de la corrida anterior.
+
+- Clave de fila: hash de CODIGO_INFORME_TECNICO y de las columnas crudas que
+  leen las etapas, más el número de ocurrencia, para que las filas repetidas
+  no se confundan. Las columnas que ninguna etapa toca se copian de la hoja
+  nueva, por lo que no entran en la clave ni en el estado.
+- ffill: FECHA_HOML y PESO_BRUTO_VH_KG heredan el valor de la fila anterior.
+  Se resuelven sobre la hoja completa antes del hash. Así una fila cuyo valor
+  heredado cambia se detecta como modificada, y las etapas de ffill no
+  dependen de las filas vecinas.
+- Etapas globales (GLOBAL_STAGES): canonicalize_models (con
+  CANONICALIZE_MODELS), que usa frecuencias de toda la hoja, y la imputación
+  por promedio de EMIS_CO2_EQUIV y REND_EQUIV_KML. Se ejecutan siempre sobre
+  el resultado completo. El estado guarda las filas antes de estas etapas.
+- El estado se invalida si cambian las columnas de la hoja, las etapas
+  seleccionadas o el catálogo de importadores. Un cambio en el código de las
+  etapas NO se detecta: después de modificarlas hay que borrar el archivo de
+  estado (INCREMENTAL_STATE_FILE).
+"""
+#----------------------------
+# LIBRERÍAS
+#----------------------------
+import logging
+from pathlib import Path
+from typing import Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+import os
+from dotenv import load_dotenv
+
+from importer_standarizer import catalog_hash, load_importer_catalog
+from stage_graph import Stage, run_stages, prune_stages, print_stage_report
+from transform_pipeline import PIPELINE_STAGES, transform_headers, resolve_forward_fills
+
+#----------------------------
+# VARIABLES DE ENTORNO
+#----------------------------
+load_dotenv("./variables_local.env")
+FOLDER_PROCESSED = os.getenv("FOLDER_PROCESSED")
+INCREMENTAL_STATE_FILE = os.getenv("INCREMENTAL_STATE_FILE", f"{FOLDER_PROCESSED}estado_incremental.pkl")
+
+logger = logging.getLogger("IncrementalPipeline")
+
+# Etapas que dependen de todas las filas: se recalculan sobre el resultado unido
+GLOBAL_STAGES = ("canonicalize_models", "fill_co2", "fill_rend")
+ROW_KEY_COLUMN = "_ROW_KEY"
+# Identificación de la homologación: siempre forma parte de la clave
+ID_COLUMNS = ["CODIGO_INFORME_TECNICO"]
+
+
+#----------------------------
+# INICIO CÓDIGO
+#----------------------------
+
+def split_stages(stages: List[Stage], global_names: Iterable[str] = GLOBAL_STAGES) -> tuple:
+    """
+    Separa las etapas en (locales, globales). Las globales pasan al final, lo
+    que solo es válido si ninguna etapa local posterior depende de ellas.
+    """
+    global_names = set(global_names)
+    local, glob = [], []
+    for stage in stages:
+        if stage.name in global_names:
+            glob.append(stage)
+            continue
+        blocking = [g.name for g in glob if stage.depends_on(g)]
+        if blocking:
+            raise ValueError(f"La etapa '{stage.name}' depende de etapas globales: {blocking}")
+        local.append(stage)
+    return local, glob
+
+
+def row_keys(df: pd.DataFrame) -> pd.Series:
+    """
+    Clave uint64 por fila: hash del contenido (columnas en orden alfabético,
+    independiente del orden de encabezados) combinado con la ocurrencia.
+    """
+    # Como object el hash es ~1.5x más rápido que sobre columnas str
+    hashes = pd.util.hash_pandas_object(df[sorted(df.columns)].astype(object), index=False)
+    occurrence = hashes.groupby(hashes.to_numpy()).cumcount()
+    keys = pd.util.hash_pandas_object(pd.DataFrame({"h": hashes, "n": occurrence}), index=False)
+    return pd.Series(keys.to_numpy(), index=df.index, name=ROW_KEY_COLUMN)
+
+
+def _first_seen_categories(values: pd.Series) -> pd.Series:
+    """Categorías sin las no usadas y en orden de aparición (como factorize)."""
+    values = values.cat.remove_unused_categories()
+    codes = values.cat.codes.to_numpy()
+    order = pd.unique(codes[codes >= 0])
+    return values.cat.reorder_categories(values.cat.categories[order])
+
+
+def merge_rows(frames: List[pd.DataFrame], index: pd.Index, columns: List[str]) -> pd.DataFrame:
+    """
+    Une filas de varias corridas en el orden de `index`. Las columnas
+    categóricas se llevan antes a las mismas categorías (concat las dejaría
+    como object) y quedan en orden de aparición, como en una corrida completa.
+    """
+    frames = [f[columns] for f in frames if len(f)]
+    categorical = [c for c in columns if isinstance(frames[0][c].dtype, pd.CategoricalDtype)]
+    for column in categorical:
+        categories = frames[0][column].cat.categories
+        for f in frames[1:]:
+            # union conserva el dtype de las categorías (append infiere str)
+            categories = categories.union(f[column].cat.categories, sort=False)
+        frames = [f.assign(**{column: f[column].cat.set_categories(categories)}) for f in frames]
+    df = pd.concat(frames).loc[index]
+    for column in categorical:
+        df[column] = _first_seen_categories(df[column])
+    return df
+
+
+def state_signature(columns: Iterable[str], stages: List[Stage]) -> dict:
+    """
+    Lo que determina el resultado guardado de una fila, además de su contenido:
+    columnas de la hoja, etapas y, si se estandarizan importadores, el catálogo.
+    """
+    signature = {"columns": sorted(columns), "stages": [s.name for s in stages]}
+    if any(s.name == "importers" for s in stages):
+        signature["importers"] = catalog_hash(load_importer_catalog())
+    return signature
+
+
+def load_state(state_file: Optional[str]) -> Optional[dict]:
+    if not state_file or not Path(state_file).exists():
+        return None
+    return pd.read_pickle(state_file)
+
+
+def save_state(state_file: Optional[str], state: dict) -> None:
+    """Guarda el estado (escritura atómica con archivo temporal)."""
+    if not state_file:
+        return
+    tmpfile = f"{state_file}.{os.getpid()}.tmp"
+    pd.to_pickle(state, tmpfile)
+    os.replace(tmpfile, state_file)
+    logger.info(f"Estado incremental guardado en: {state_file}")
+
+
+def pipeline_transformation_incremental(
+    df: pd.DataFrame,
+    state_file: Optional[str] = INCREMENTAL_STATE_FILE,
+    outputs: Optional[list[str]] = None,
+    report: bool = False,
+) -> pd.DataFrame:
+    """
+    Igual que transform_pipeline.pipeline_transformation, pero solo transforma
+    las filas cuya clave no está en el estado de la corrida anterior.
+
+    El estado se descarta (corrida completa) si cambia state_signature. Para
+    forzar una corrida completa (p.ej. tras cambiar el código de una etapa),
+    borrar `state_file`.
+    """
+    print("="*80)
+    logger.info("Transformación de Headers")
+    raw = resolve_forward_fills(transform_headers(df))
+
+    selected = prune_stages(PIPELINE_STAGES, outputs)
+    local, glob = split_stages(selected)
+    signature = state_signature(raw.columns, selected)
+    # Solo las columnas que las etapas leen o escriben definen la clave y se
+    # guardan en el estado; el resto pasa tal cual desde la hoja nueva
+    touched = set(ID_COLUMNS).union(*(s.reads | s.writes for s in selected))
+    stage_columns = [c for c in raw.columns if c in touched]
+    keys = row_keys(raw[stage_columns])
+
+    state = load_state(state_file)
+    if state is not None and state["signature"] != signature:
+        logger.info("El estado incremental no corresponde a esta hoja, etapas o catálogo: corrida completa")
+        state = None
+    if state is None:
+        previous = raw[stage_columns].iloc[:0].assign(**{ROW_KEY_COLUMN: keys.iloc[:0]})
+    else:
+        previous = state["rows"]
+
+    known = keys.isin(previous[ROW_KEY_COLUMN])
+    logger.info(f"Filas: {len(raw)} ({int((~known).sum())} nuevas o modificadas, "
+                f"{len(previous) - int(known.sum())} eliminadas)")
+
+    # Filas nuevas: etapas locales; filas conocidas: resultado guardado
+    reused = previous.set_index(ROW_KEY_COLUMN, drop=False).loc[keys[known]]
+    reused.index = keys.index[known.to_numpy()]
+    if known.all():
+        delta, stage_report = reused.iloc[:0], pd.DataFrame()
+    else:
+        delta, stage_report = run_stages(raw.loc[~known.to_numpy(), stage_columns], local)
+        delta[ROW_KEY_COLUMN] = keys[~known]
+    created = [c for c in (delta if len(delta) else previous).columns if c not in raw.columns]
+    rows = merge_rows([reused, delta], raw.index, stage_columns + created)
+    save_state(state_file, {"signature": signature, "rows": rows})
+
+    # Etapas globales sobre todas las filas
+    rows = pd.concat([raw.drop(columns=stage_columns), rows.drop(columns=ROW_KEY_COLUMN)], axis=1)
+    rows = rows[list(raw.columns) + [c for c in created if c != ROW_KEY_COLUMN]]
+    df, global_report = run_stages(rows, glob)
+    if report:
+        print_stage_report(pd.concat([stage_report, global_report], ignore_index=True))
+    print("="*80)
+    return df
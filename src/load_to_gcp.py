@@ -5,6 +5,7 @@ import pandas as pd
 from typing import Optional
 
 from transform_pipeline import read_xls_files, pipeline_transformation
+from incremental_pipeline import pipeline_transformation_incremental
 from extraction import init_gcp_client, upload_to_bucket
 
 import os
@@ -25,6 +26,7 @@ RAWDATANAME = os.getenv("RAWDATANAME", "dataRawHom")
 DEFAULT_FILETYPE = os.getenv("DEFAULT_FILETYPE", "xls")
 DEFAULT_VERIFY_TLS = bool(os.getenv("VERIFY_TLS"))
 FOLDER_TMP = Path(os.getenv("FOLDER_TMP"))
+INCREMENTAL_TRANSFORM = bool(os.getenv("INCREMENTAL_TRANSFORM"))
 
 
 usedcolumns =[# informativos
@@ -75,7 +77,10 @@ print("="*80)
 #Transformación de datos
 print("="*80)
 logging.info("Iniciando transformaciones...")
-df = pipeline_transformation(df)
+if INCREMENTAL_TRANSFORM:
+    df = pipeline_transformation_incremental(df, outputs=usedcolumns)
+else:
+    df = pipeline_transformation(df, outputs=usedcolumns)
 print("="*80)
 
 
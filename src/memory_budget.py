@@ -0,0 +1,129 @@
+"""
+Presupuesto de memoria por proceso
+Mide la memoria residente (RSS) del proceso con un hilo muestreador y marca
+cuándo se supera el presupuesto. Las etapas pesadas llaman a check_budget()
+en sus bucles (puntos de control cooperativos): la ejecución se corta en el
+siguiente punto de control, sin esperar el fin de la etapa, y el ejecutor
+revisa además antes y después de cada etapa. Se usa desde stage_graph.run_stages
+para reportar el peak de RSS de cada etapa: en un host con varios pipelines el
+peak de memoria es lo que limita cuántos caben a la vez.
+"""
+#----------------------------
+# LIBRERÍAS
+#----------------------------
+import logging
+import resource
+import sys
+import threading
+from typing import Optional
+
+import os
+from dotenv import load_dotenv
+
+#----------------------------
+# VARIABLES DE ENTORNO
+#----------------------------
+load_dotenv("./variables_local.env")
+# Presupuesto por defecto de pipeline_transformation (sin definir: sin presupuesto)
+MEMORY_BUDGET_MB = float(os.getenv("MEMORY_BUDGET_MB")) if os.getenv("MEMORY_BUDGET_MB") else None
+
+_PAGE_MB = os.sysconf("SC_PAGE_SIZE") / 2**20 if hasattr(os, "sysconf") else None
+
+logger = logging.getLogger("MemoryBudget")
+
+
+#----------------------------
+# INICIO CÓDIGO
+#----------------------------
+
+class MemoryBudgetExceeded(MemoryError):
+    """El RSS del proceso superó el presupuesto durante una etapa."""
+
+    def __init__(self, stage: str, rss_mb: float, budget_mb: float):
+        super().__init__(f"Etapa '{stage}': RSS {rss_mb:.0f} MB supera el presupuesto de {budget_mb:.0f} MB")
+        self.stage = stage
+        self.rss_mb = rss_mb
+        self.budget_mb = budget_mb
+
+
+def peak_rss_mb() -> float:
+    """Peak de RSS del proceso desde su inicio (ru_maxrss)."""
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reporta KB; macOS, bytes
+    return maxrss / 2**20 if sys.platform == "darwin" else maxrss / 2**10
+
+
+def current_rss_mb() -> float:
+    """RSS actual del proceso (/proc/self/statm); sin /proc, el peak histórico."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_MB
+    except (OSError, TypeError):
+        return peak_rss_mb()
+
+
+class RssMonitor:
+    """
+    Muestrea el RSS cada `interval` segundos mientras está activo y guarda el
+    peak desde el último reset(). Si se define `budget_mb` y se supera, marca
+    `exceeded`; check_budget() (dentro de las etapas) y el ejecutor (entre
+    etapas) lo revisan y lanzan MemoryBudgetExceeded. Mientras está activo es
+    el monitor que consulta check_budget(); `stage` es la etapa en curso.
+    """
+
+    def __init__(self, budget_mb: Optional[float] = None, interval: float = 0.005):
+        self.budget_mb = budget_mb
+        self.interval = interval
+        self.peak_mb = 0.0
+        self.exceeded = False
+        self.stage = ""
+        self._previous: Optional["RssMonitor"] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def reset(self) -> float:
+        """Reinicia el peak (y `exceeded`) al RSS actual y lo retorna."""
+        self.exceeded = False
+        self.peak_mb = current_rss_mb()
+        return self.peak_mb
+
+    def sample(self) -> float:
+        rss = current_rss_mb()
+        self.peak_mb = max(self.peak_mb, rss)
+        if self.budget_mb is not None and rss > self.budget_mb:
+            self.exceeded = True
+        return rss
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def __enter__(self) -> "RssMonitor":
+        global _active_monitor
+        self.reset()
+        self._previous, _active_monitor = _active_monitor, self
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        global _active_monitor
+        self._stop.set()
+        self._thread.join()
+        _active_monitor = self._previous
+
+
+# Monitor del run_stages en curso (None: sin presupuesto)
+_active_monitor: Optional[RssMonitor] = None
+
+
+def check_budget() -> None:
+    """
+    Punto de control cooperativo para bucles de etapas pesadas: lanza
+    MemoryBudgetExceeded si el RSS ya superó el presupuesto del monitor activo.
+    Sin presupuesto activo es solo una lectura, así que se puede llamar por
+    iteración.
+    """
+    monitor = _active_monitor
+    if monitor is not None and monitor.exceeded:
+        raise MemoryBudgetExceeded(monitor.stage, monitor.peak_mb, monitor.budget_mb)
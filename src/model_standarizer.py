@@ -0,0 +1,270 @@
+"""
+Canonicalización de MARCA/MODELO
+Agrupa variantes de escritura del mismo modelo dentro de cada marca
+("rav 4" / "rav4", "pick up." / "pick up", "hatchbak" / "hatchback") y las
+reemplaza por un nombre canónico. El mapeo se persiste para que los nombres
+canónicos se mantengan estables entre corridas. En transform_pipeline la etapa
+solo se ejecuta con CANONICALIZE_MODELS definida.
+
+Dos modelos son la misma variante si difieren solo en espacios, puntuación u
+orden de palabras, o en un typo dentro de una única palabra larga sin
+dígitos (mismo inicio). Para no comparar todos los pares, los modelos se
+agrupan en bloques por (marca, dígitos del texto compacto): solo se comparan
+modelos con la misma cilindrada, puertas, etc. La clave no depende de espacios
+ni puntuación, así "rav 4"/"rav4" y "pick up"/"pickup"/"pick-up" caen juntos.
+"""
+import re
+import json
+import numpy as np
+import pandas as pd
+
+from collections import Counter, defaultdict
+from difflib import SequenceMatcher
+from typing import Dict, List, Optional
+from text_normalization import fold_lower
+from memory_budget import check_budget
+
+import os
+from pathlib import Path
+from dotenv import load_dotenv
+import logging
+
+#----------------------------
+# CONFIGURACIONES
+#----------------------------
+load_dotenv("./variables_local.env")
+
+FOLDER_PROCESSED = os.getenv("FOLDER_PROCESSED")
+MODEL_CANON_FILE = os.getenv("MODEL_CANON_FILE", f"{FOLDER_PROCESSED}canon_modelos.json")
+
+# Largo mínimo de una palabra para aceptar un typo en ella (phev/mhev, 118i/118d no son typos)
+TYPO_TOKEN_LEN = 5
+
+# Configuración básica para .log
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+logging.basicConfig(
+    level=LOG_LEVEL,
+    format="%(asctime)s | %(levelname)s | %(name)s | %(message)s",
+)
+
+#----------------------------
+# FUNCIONES
+#----------------------------
+def compact_name(text: str) -> str:
+    """Texto sin espacios ni puntuación (salvo '/'): 'Rav 4 2,0 lts.' -> 'rav420lts'."""
+    return re.sub(r"[^\w/]+", "", fold_lower(str(text)))
+
+
+def model_tokens(model: str) -> List[str]:
+    """Palabras del modelo, sin puntuación: '2.4 xr-p 4p.' -> ['2', '4', 'xr-p', '4p']."""
+    return [t for t in re.split(r"[\s\.,;()]+", fold_lower(str(model))) if t]
+
+
+def model_block_key(model: str) -> str:
+    """
+    Clave de bloqueo de un modelo: dígitos de su texto compacto, en orden
+    ('rav 4 2.0' y 'rav4 2,0' -> '420'). Dos modelos solo se comparan si la comparten.
+    """
+    return "".join(re.findall(r"\d", compact_name(model)))
+
+
+def same_model(tokens_a: List[str], tokens_b: List[str], threshold: float) -> bool:
+    """
+    True si dos modelos (ya tokenizados) son variantes de escritura:
+    mismas palabras en cualquier orden, o una sola palabra distinta con un typo
+    (solo letras, ambas largas, mismas dos primeras letras y ratio >= threshold).
+    """
+    if compact_name("".join(tokens_a)) == compact_name("".join(tokens_b)):
+        return True
+    only_a = Counter(tokens_a) - Counter(tokens_b)
+    only_b = Counter(tokens_b) - Counter(tokens_a)
+    if not only_a and not only_b:
+        return True
+    if sum(only_a.values()) != 1 or sum(only_b.values()) != 1:
+        return False
+    a, b = next(iter(only_a)), next(iter(only_b))
+    # Solo palabras: en códigos con dígitos (xdrive20i/xdrive20d) una letra es otra versión
+    if not (a.isalpha() and b.isalpha()):
+        return False
+    if min(len(a), len(b)) < TYPO_TOKEN_LEN or a[:2] != b[:2]:
+        return False
+    return SequenceMatcher(None, a, b).ratio() >= threshold
+
+
+def _group_block(models: List[str], counts: Counter, canonical: Dict[str, str],
+                 threshold: float) -> Dict[str, str]:
+    """
+    Agrupa los modelos de un bloque (union-find sobre same_model) y asigna
+    a cada uno el canónico de su grupo: el ya persistido si existe, si no la
+    variante más frecuente (a igualdad, la primera en aparecer).
+    """
+    parent = list(range(len(models)))
+
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    tokens = [model_tokens(m) for m in models]
+    for i in range(len(models)):
+        for j in range(i + 1, len(models)):
+            if find(i) != find(j) and same_model(tokens[i], tokens[j], threshold):
+                parent[find(j)] = find(i)
+
+    groups = defaultdict(list)
+    for i, model in enumerate(models):
+        groups[find(i)].append(model)
+
+    position = {m: i for i, m in enumerate(models)}
+    mapping = {}
+    for members in groups.values():
+        known = [canonical[m] for m in members if m in canonical]
+        if known:
+            target = Counter(known).most_common(1)[0][0]
+        else:
+            target = max(members, key=lambda m: (counts[m], -position[m]))
+        mapping.update({m: target for m in members})
+    return mapping
+
+
+def build_model_mapping(
+    data: pd.DataFrame,
+    threshold: float = 0.85,
+    known: Optional[Dict[str, Dict[str, str]]] = None,
+    brand_col: str = "MARCA",
+    model_col: str = "MODELO",
+) -> Dict[str, Dict[str, str]]:
+    """
+    Genera el mapeo {marca: {modelo: modelo canónico}}.
+
+    Las marcas se canonicalizan solo por texto compacto ("m.benz" -> "m. benz");
+    los modelos se agrupan por marca con bloqueo y same_model(threshold).
+    `known` (mapeo persistido) se respeta: sus modelos conservan su canónico y
+    los modelos nuevos se unen a esos grupos cuando corresponde.
+    """
+    known = {} if known is None else known
+    pairs = data[[brand_col, model_col]].dropna()
+
+    mapping = {}
+    for brand, brand_pairs in pairs.groupby(brand_col, sort=False):
+        check_budget()
+        brand_known = known.get(brand, {})
+        # Los canónicos persistidos participan del bloqueo para atraer variantes nuevas
+        models = list(dict.fromkeys(list(brand_known.values()) + brand_pairs[model_col].unique().tolist()))
+        missing = [m for m in models if m not in brand_known]
+        if not missing:
+            mapping[brand] = dict(brand_known)
+            continue
+        canonical = {**{v: v for v in brand_known.values()}, **brand_known}
+        brand_counts = Counter(brand_pairs[model_col].value_counts().to_dict())
+
+        blocks = defaultdict(list)
+        for model in models:
+            blocks[model_block_key(model)].append(model)
+        brand_mapping = dict(brand_known)
+        for block in blocks.values():
+            if any(m not in brand_known for m in block):
+                brand_mapping.update(_group_block(block, brand_counts, canonical, threshold))
+        mapping[brand] = brand_mapping
+    return mapping
+
+
+def load_model_mapping(mapping_file: Optional[str]) -> Dict[str, Dict[str, str]]:
+    if not mapping_file or not Path(mapping_file).exists():
+        return {}
+    with open(mapping_file, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_model_mapping(mapping_file: Optional[str], mapping: Dict[str, Dict[str, str]]) -> None:
+    """Guarda el mapeo canónico (escritura atómica con archivo temporal)."""
+    if not mapping_file:
+        return
+    tmpfile = f"{mapping_file}.{os.getpid()}.tmp"
+    with open(tmpfile, "w", encoding="utf-8") as f:
+        json.dump(mapping, f, indent=2, ensure_ascii=False)
+    os.replace(tmpfile, mapping_file)
+    logging.info("Mapeo de modelos guardado en: %s", mapping_file)
+
+
+def _as_categorical(values: pd.Series) -> pd.Series:
+    """La columna como categórica (categorías en orden de aparición)."""
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return values
+    codes, uniques = pd.factorize(values)
+    return pd.Series(pd.Categorical.from_codes(codes, pd.Index(uniques, dtype=object)),
+                     index=values.index, name=values.name)
+
+
+def _recode(values: pd.Series, codes: np.ndarray, targets: List) -> pd.Series:
+    """
+    Categórica con targets[code] por fila (-1 o target None: nulo). Las
+    categorías quedan sin las no usadas y en orden de aparición, como en
+    transform_category_cols.
+    """
+    targets = pd.Index(targets, dtype=object)
+    categories = targets.dropna().unique()
+    # Código de categoría por target (None -> -1); los códigos -1 apuntan a la última posición
+    remap = np.append(categories.get_indexer(targets), -1)
+    result = pd.Categorical.from_codes(remap[codes], categories).remove_unused_categories()
+    order = pd.unique(result.codes[result.codes >= 0])
+    result = result.reorder_categories(result.categories[order])
+    return pd.Series(result, index=values.index, name=values.name)
+
+
+def canonicalize_models(
+    data: pd.DataFrame,
+    threshold: float = 0.85,
+    mapping_file: Optional[str] = MODEL_CANON_FILE,
+    brand_col: str = "MARCA",
+    model_col: str = "MODELO",
+) -> pd.DataFrame:
+    """
+    Reemplaza MARCA y MODELO por sus nombres canónicos (en el mismo DataFrame).
+    Espera columnas ya normalizadas por transform_category_cols y las deja
+    categóricas como ella: los mapeos se aplican por valor distinto.
+    """
+    logging.info("Canonicalización de MARCA/MODELO")
+    # Todo se resuelve por categoría (valor distinto), no por fila
+    brands = _as_categorical(data[brand_col])
+    brand_codes = brands.cat.codes.to_numpy()
+    brand_names = list(brands.cat.categories)
+
+    # Marcas: mismo texto compacto -> la variante más frecuente (a igualdad, la primera)
+    counts = np.bincount(brand_codes[brand_codes >= 0], minlength=len(brand_names))
+    by_compact = {}
+    for code in sorted(pd.unique(brand_codes[brand_codes >= 0]), key=lambda c: -counts[c]):
+        by_compact.setdefault(compact_name(brand_names[code]), brand_names[code])
+    data[brand_col] = brands = _recode(
+        brands, brand_codes, [by_compact.get(compact_name(b), b) for b in brand_names])
+
+    known = load_model_mapping(mapping_file)
+    mapping = build_model_mapping(data, threshold, known, brand_col, model_col)
+    merged = {**known, **mapping}
+    if merged != known:
+        save_model_mapping(mapping_file, merged)
+
+    # Un valor canónico por par (marca, modelo) distinto y gather por código
+    models = _as_categorical(data[model_col])
+    n_before = models.nunique()
+    brand_codes = brands.cat.codes.to_numpy().astype(np.int64)
+    model_codes = models.cat.codes.to_numpy().astype(np.int64)
+    brand_names, model_names = list(brands.cat.categories), list(models.cat.categories)
+    # Pares con marca nula conservan el modelo: se indexan como marca "extra"
+    pair_keys = np.where(model_codes >= 0,
+                         np.where(brand_codes >= 0, brand_codes, len(brand_names)) * len(model_names) + model_codes,
+                         -1)
+    pair_codes, pairs = pd.factorize(pair_keys, use_na_sentinel=False)
+    canon = []
+    for key in pairs:
+        if key < 0:
+            canon.append(None)
+            continue
+        brand, model = divmod(int(key), len(model_names))
+        model = model_names[model]
+        canon.append(mapping.get(brand_names[brand], {}).get(model, model)
+                     if brand < len(brand_names) else model)
+    data[model_col] = _recode(models, pair_codes, canon)
+    logging.info("Modelos: %d -> %d nombres distintos", n_before, data[model_col].nunique())
+    return data
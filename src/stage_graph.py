@@ -0,0 +1,218 @@
+"""
+Ejecutor de etapas por columnas
+Cada etapa declara las columnas que lee y las que escribe. A partir de esas
+declaraciones el ejecutor:
+  - descarta las etapas que no contribuyen a las columnas de salida pedidas,
+  - ordena las etapas en olas: una etapa depende de una anterior si lee lo que
+    esta escribe, escribe lo que esta lee o ambas escriben la misma columna,
+  - ejecuta en paralelo (hilos) las etapas de una misma ola, cada una sobre su
+    propio sub-DataFrame con las columnas declaradas, y
+  - reporta tiempo y memoria por etapa.
+El resultado es el mismo que ejecutar las etapas en secuencia, en el orden en
+que se declararon.
+"""
+#----------------------------
+# LIBRERÍAS
+#----------------------------
+import logging
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from typing import Callable, Dict, Iterable, List, Optional
+
+import pandas as pd
+
+from memory_budget import MemoryBudgetExceeded, RssMonitor
+
+#----------------------------
+# CONFIGURACIONES LOGGING
+#----------------------------
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s | %(levelname)s | %(name)s | %(message)s"
+)
+logger = logging.getLogger("StageGraph")
+
+
+#----------------------------
+# INICIO CÓDIGO
+#----------------------------
+
+class Stage:
+    """Etapa del pipeline: func(df) -> df, con sus columnas de lectura y escritura."""
+
+    def __init__(self, name: str, func: Callable[[pd.DataFrame], pd.DataFrame],
+                 reads: Iterable[str], writes: Iterable[str]):
+        self.name = name
+        self.func = func
+        self.reads = frozenset(reads)
+        self.writes = frozenset(writes)
+
+    def depends_on(self, other: "Stage") -> bool:
+        """True si la etapa debe ejecutarse después de `other` (declarada antes)."""
+        return bool(other.writes & self.reads or other.writes & self.writes
+                    or other.reads & self.writes)
+
+    def __repr__(self) -> str:
+        return f"Stage({self.name!r})"
+
+
+def prune_stages(stages: List[Stage], outputs: Optional[Iterable[str]] = None) -> List[Stage]:
+    """
+    Etapas necesarias para producir `outputs` (todas si es None). Se recorre
+    desde la última etapa: una etapa se mantiene si escribe alguna columna
+    necesaria, y entonces sus lecturas pasan a ser necesarias.
+    """
+    if outputs is None:
+        return list(stages)
+    needed = set(outputs)
+    kept = []
+    for stage in reversed(stages):
+        if stage.writes & needed:
+            kept.append(stage)
+            needed |= stage.reads
+    return kept[::-1]
+
+
+def schedule_waves(stages: List[Stage]) -> List[List[Stage]]:
+    """Agrupa las etapas en olas; dentro de una ola no hay dependencias."""
+    level: Dict[int, int] = {}
+    for j, stage in enumerate(stages):
+        level[j] = 1 + max((level[i] for i in range(j) if stage.depends_on(stages[i])), default=-1)
+    waves = [[] for _ in range(max(level.values(), default=-1) + 1)]
+    for j, stage in enumerate(stages):
+        waves[level[j]].append(stage)
+    return waves
+
+
+def _frame_mb(df: pd.DataFrame) -> float:
+    return df.memory_usage(deep=True, index=False).sum() / 2**20
+
+
+def _run_stage(stage: Stage, df: pd.DataFrame) -> tuple:
+    columns = [c for c in df.columns if c in stage.reads or c in stage.writes]
+    start = time.perf_counter()
+    # Con copy-on-write la selección no copia datos hasta que la etapa escribe
+    out = stage.func(df[columns])
+    return out, time.perf_counter() - start
+
+
+def run_stages(
+    df: pd.DataFrame,
+    stages: List[Stage],
+    outputs: Optional[Iterable[str]] = None,
+    max_workers: int = 1,
+    trace_memory: bool = False,
+    memory_budget_mb: Optional[float] = None,
+) -> tuple:
+    """
+    Ejecuta las etapas necesarias para `outputs` sobre df.
+
+    Args:
+        df: DataFrame de entrada (no se modifica)
+        stages: Etapas en orden secuencial de referencia
+        outputs: Columnas requeridas; None ejecuta todas las etapas
+        max_workers: Hilos por ola (1: secuencial)
+        trace_memory: Medir el peak de memoria asignada con tracemalloc
+        memory_budget_mb: Modo presupuesto: mide el peak de RSS de cada etapa
+            y lanza MemoryBudgetExceeded cuando el RSS supera el presupuesto:
+            en el siguiente punto de control de la etapa (memory_budget.check_budget)
+            o, en etapas sin puntos de control, al terminar la etapa (u ola).
+            float("inf") solo reporta
+
+    Las mediciones de memoria son por etapa en ejecución secuencial y por ola
+    (compartidas) cuando las etapas de una ola corren en paralelo.
+
+    Returns:
+        (DataFrame transformado, DataFrame de reporte por etapa)
+    """
+    selected = prune_stages(stages, outputs)
+    skipped = [s.name for s in stages if s not in selected]
+    if skipped:
+        logger.info(f"Etapas descartadas (no aportan a la salida): {', '.join(skipped)}")
+    waves = schedule_waves(selected)
+    logger.info(f"{len(selected)} etapas en {len(waves)} olas")
+    # Grupos que se miden juntos: la ola completa solo si corre en paralelo
+    groups = []
+    for n_wave, wave in enumerate(waves):
+        if max_workers > 1 and len(wave) > 1:
+            groups.append((n_wave, wave))
+        else:
+            groups.extend((n_wave, [stage]) for stage in wave)
+
+    original = list(df.columns)
+    # Copia superficial: con copy-on-write las etapas nunca escriben sobre la entrada
+    df = df.copy(deep=False)
+    results = {}
+    report = []
+    monitor = RssMonitor(memory_budget_mb) if memory_budget_mb is not None else nullcontext()
+    if trace_memory:
+        tracemalloc.start()
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool, monitor:
+            for n_group, (n_wave, group) in enumerate(groups):
+                running = ", ".join(s.name for s in group)
+                if memory_budget_mb is not None:
+                    monitor.stage = running
+                    rss_start = monitor.reset()
+                    if rss_start > memory_budget_mb:
+                        raise MemoryBudgetExceeded(running, rss_start, memory_budget_mb)
+                if trace_memory:
+                    tracemalloc.reset_peak()
+                group_start = time.perf_counter()
+                if len(group) > 1:
+                    outs = list(pool.map(lambda s: _run_stage(s, df), group))
+                else:
+                    outs = [_run_stage(group[0], df)]
+                group_seconds = time.perf_counter() - group_start
+                peak_mb = tracemalloc.get_traced_memory()[1] / 2**20 if trace_memory else None
+                rss = {}
+                if memory_budget_mb is not None:
+                    rss = {"rss_mb": monitor.sample(), "peak_rss_mb": monitor.peak_mb}
+                    if monitor.exceeded:
+                        raise MemoryBudgetExceeded(running, monitor.peak_mb, memory_budget_mb)
+
+                # Las columnas escritas vuelven al DataFrame en el orden declarado
+                for stage, (out, seconds) in zip(group, outs):
+                    written = [c for c in out.columns if c in stage.writes]
+                    for column in written:
+                        df[column] = out[column]
+                    results[stage.name] = written
+                    report.append({
+                        "stage": stage.name,
+                        "wave": n_wave,
+                        "group": n_group,
+                        "seconds": seconds,
+                        "group_seconds": group_seconds,
+                        "output_mb": _frame_mb(out[written]),
+                        "peak_mb": peak_mb,
+                        **rss,
+                    })
+                    logger.info(f"[ola {n_wave}] {stage.name}: {seconds:.3f} s")
+                del outs
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+
+    # Columnas nuevas en el orden en que las crearía la ejecución secuencial
+    created = [c for s in selected for c in results[s.name] if c not in original]
+    df = df[original + list(dict.fromkeys(created))]
+    return df, pd.DataFrame(report)
+
+
+def print_stage_report(report: pd.DataFrame) -> None:
+    rss = "peak_rss_mb" in report
+    print("="*80)
+    print("REPORTE DE ETAPAS")
+    print("="*80)
+    print(f"{'Etapa':<24}{'Ola':>5}{'Tiempo (s)':>12}{'Salida (MB)':>13}{'Peak (MB)':>11}"
+          + (f"{'Peak RSS (MB)':>15}" if rss else ""))
+    print("-"*80)
+    for r in report.itertuples():
+        peak = f"{r.peak_mb:>11.1f}" if pd.notna(r.peak_mb) else f"{'-':>11}"
+        print(f"{r.stage:<24}{r.wave:>5}{r.seconds:>12.3f}{r.output_mb:>13.1f}{peak}"
+              + (f"{r.peak_rss_mb:>15.1f}" if rss else ""))
+    print("-"*80)
+    total = report.drop_duplicates("group")["group_seconds"].sum() if len(report) else 0.0
+    print(f"{'Total':<29}{total:>12.3f}")
@@ -0,0 +1,183 @@
+"""
+Transformación por bloques de filas (streaming) para hojas que no caben en memoria
+Los datasets combinados de varios años no caben completos en memoria como
+texto (object). Este modo los procesa por bloques de filas:
+
+- Primera pasada: cada bloque pasa por las etapas por fila del pipeline. Los
+  ffill de FECHA_HOML y PESO_BRUTO_VH_KG continúan con el último valor del
+  bloque anterior. Se acumulan sumas y conteos para la imputación por promedio
+  de EMIS_CO2_EQUIV y REND_EQUIV_KML, y el bloque se guarda en disco.
+- Segunda pasada: cada bloque guardado se completa con los promedios globales
+  y se escribe de inmediato en la salida.
+
+La memoria queda acotada por el tamaño del bloque. Con CANONICALIZE_MODELS,
+MARCA/MODELO se canonicalizan por bloque con el mapeo persistido (ver
+model_standarizer): las frecuencias usadas para elegir el nombre canónico de
+un grupo nuevo son las del bloque donde aparece por primera vez.
+
+Uso:
+    python src/streaming_pipeline.py datos_combinados.csv salida.csv --chunksize 50000
+"""
+#----------------------------
+# LIBRERÍAS
+#----------------------------
+import argparse
+import logging
+import tempfile
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+
+import os
+from dotenv import load_dotenv
+
+from stage_graph import run_stages, prune_stages
+from transform_pipeline import (PIPELINE_STAGES, header_mapping, apply_header_mapping,
+                                resolve_forward_fills, last_filled_values, zero_bev_co2)
+
+#----------------------------
+# VARIABLES DE ENTORNO
+#----------------------------
+load_dotenv("./variables_local.env")
+STREAMING_CHUNKSIZE = int(os.getenv("STREAMING_CHUNKSIZE", "50000"))
+
+#----------------------------
+# CONFIGURACIONES LOGGING
+#----------------------------
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s | %(levelname)s | %(name)s | %(message)s"
+)
+logger = logging.getLogger("StreamingPipeline")
+
+# Imputaciones por promedio global: se resuelven en la segunda pasada
+MEAN_FILL_STAGES = ("fill_co2", "fill_rend")
+MEAN_FILL_COLUMNS = ["EMIS_CO2_EQUIV", "REND_EQUIV_KML"]
+
+
+#----------------------------
+# INICIO CÓDIGO
+#----------------------------
+
+def read_raw_chunks(filename: str, chunksize: int = STREAMING_CHUNKSIZE) -> Iterator[pd.DataFrame]:
+    """
+    Bloques de filas crudas (texto). Los CSV se leen por bloques; los Excel no
+    se pueden leer por partes, así que se leen completos y se entregan en bloques.
+    """
+    if Path(filename).suffix.lower() == ".csv":
+        yield from pd.read_csv(filename, dtype=str, chunksize=chunksize)
+        return
+    data = pd.read_excel(filename, sheet_name=0, dtype=str)
+    for start in range(0, len(data), chunksize):
+        yield data.iloc[start:start + chunksize]
+
+
+class CsvSink:
+    """
+    Salida CSV escrita bloque a bloque. Se escribe a un archivo temporal que
+    reemplaza al destino recién en close(), para no dejar salidas a medias.
+    """
+
+    def __init__(self, pathfile: str, columns: Optional[List[str]] = None):
+        self.pathfile = Path(pathfile)
+        self.columns = columns
+        self._tmpfile = Path(f"{pathfile}.{os.getpid()}.tmp")
+        self._rows = 0
+
+    def write(self, chunk: pd.DataFrame) -> None:
+        first = self._rows == 0
+        chunk.to_csv(self._tmpfile, mode="w" if first else "a", header=first,
+                     index=False, columns=self.columns)
+        self._rows += len(chunk)
+
+    def close(self) -> None:
+        if self._rows == 0:
+            # Sin filas: solo el encabezado, o un archivo vacío si no se conocen las columnas
+            if self.columns:
+                pd.DataFrame(columns=self.columns).to_csv(self._tmpfile, index=False)
+            else:
+                self._tmpfile.write_text("")
+        os.replace(self._tmpfile, self.pathfile)
+        logger.info(f"{self._rows} filas escritas en {self.pathfile}")
+
+
+def pipeline_transformation_streaming(
+    chunks: Iterable[pd.DataFrame],
+    sink: Callable[[pd.DataFrame], None],
+    outputs: Optional[list[str]] = None,
+    spill_dir: Optional[str] = None,
+) -> dict:
+    """
+    Transforma los bloques de la hoja y los entrega a `sink` (p.ej. CsvSink.write).
+    El primer bloque debe incluir las filas de encabezados.
+
+    Args:
+        chunks: Bloques consecutivos de la hoja cruda (índice continuo, como read_csv)
+        sink: Recibe cada bloque transformado, en orden
+        outputs: Columnas requeridas (ver stage_graph.prune_stages)
+        spill_dir: Carpeta para los bloques intermedios (por defecto, temporal)
+
+    Returns:
+        Promedios globales usados en la imputación {columna: promedio}
+    """
+    selected = prune_stages(PIPELINE_STAGES, outputs)
+    stages = [s for s in selected if s.name not in MEAN_FILL_STAGES]
+    mean_columns = [c for c in MEAN_FILL_COLUMNS
+                    if any(c in s.writes for s in selected if s.name in MEAN_FILL_STAGES)]
+    sums = dict.fromkeys(mean_columns, 0.0)
+    counts = dict.fromkeys(mean_columns, 0)
+
+    with tempfile.TemporaryDirectory(dir=spill_dir) as tmpdir:
+        # Primera pasada: etapas por fila, estado entre bloques y acumulados
+        spilled = []
+        header, previous = None, None
+        for n_chunk, chunk in enumerate(chunks):
+            if header is None:
+                header = header_mapping(chunk)
+            chunk = apply_header_mapping(chunk, *header)
+            if not len(chunk):
+                continue
+            chunk = resolve_forward_fills(chunk, previous)
+            previous = last_filled_values(chunk, previous)
+            chunk, _ = run_stages(chunk, stages)
+            if "EMIS_CO2_EQUIV" in mean_columns:
+                chunk = zero_bev_co2(chunk)
+            for column in mean_columns:
+                values = chunk[column].to_numpy(dtype=float, na_value=np.nan)
+                sums[column] += np.nansum(values)
+                counts[column] += int(np.count_nonzero(~np.isnan(values)))
+            path = Path(tmpdir) / f"bloque_{n_chunk:06d}.pkl"
+            chunk.to_pickle(path)
+            spilled.append(path)
+            logger.info(f"Bloque {n_chunk}: {len(chunk)} filas")
+
+        # Segunda pasada: imputación con los promedios globales y escritura
+        means = {c: round(sums[c]/counts[c], 2) if counts[c] else np.nan for c in mean_columns}
+        logger.info(f"Promedios globales: {means}")
+        for path in spilled:
+            chunk = pd.read_pickle(path)
+            for column, mean in means.items():
+                chunk[column] = chunk[column].fillna(mean)
+            sink(chunk)
+            path.unlink()
+    return means
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Transformación por bloques de filas")
+    parser.add_argument("input", help="Hoja cruda (.csv por bloques, o Excel)")
+    parser.add_argument("output", help="CSV de salida")
+    parser.add_argument("--chunksize", type=int, default=STREAMING_CHUNKSIZE)
+    parser.add_argument("--spill-dir", default=None, help="Carpeta para bloques intermedios")
+    args = parser.parse_args()
+
+    sink = CsvSink(args.output)
+    pipeline_transformation_streaming(read_raw_chunks(args.input, args.chunksize),
+                                      sink.write, spill_dir=args.spill_dir)
+    sink.close()
+
+
+if __name__ == "__main__":
+    main()
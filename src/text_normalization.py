@@ -0,0 +1,50 @@
+"""
+Normalización de texto compartida (plegado a ASCII)
+Reemplazo de `unidecode` para los caminos calientes: los caracteres latinos
+(Latin-1, Latin Extended y puntuación tipográfica) se pliegan con una tabla
+precomputada de str.translate; los textos con otros caracteres pasan por
+unidecode con una caché acotada. El resultado es idéntico a unidecode(text).
+"""
+#----------------------------
+# LIBRERÍAS
+#----------------------------
+import string
+from functools import lru_cache
+
+from unidecode import unidecode
+
+#----------------------------
+# TABLAS
+#----------------------------
+# unidecode translitera carácter a carácter, por lo que la tabla reproduce su salida
+_FOLDED_RANGES = (
+    range(0x80, 0x250),      # Latin-1 Supplement, Latin Extended-A/B (tildes, ñ, ü, ç, ...)
+    range(0x2010, 0x2060),   # Puntuación general (guiones, comillas tipográficas, ...)
+)
+ASCII_TABLE = {cp: unidecode(chr(cp)) for cp_range in _FOLDED_RANGES for cp in cp_range}
+
+# Caracteres que \s reconoce en ASCII (para borrar espacios sin regex)
+WHITESPACE = string.whitespace + "\x1c\x1d\x1e\x1f"
+
+
+#----------------------------
+# FUNCIONES
+#----------------------------
+@lru_cache(maxsize=65536)
+def _fold_other(text: str) -> str:
+    return unidecode(text)
+
+
+def fold_ascii(text: str) -> str:
+    """Equivalente a unidecode(text): tabla para el rango latino, caché para el resto."""
+    if text.isascii():
+        return text
+    folded = text.translate(ASCII_TABLE)
+    if folded.isascii():
+        return folded
+    return _fold_other(text)
+
+
+def fold_lower(text: str) -> str:
+    """Equivalente a unidecode(text.lower())."""
+    return fold_ascii(text.lower())
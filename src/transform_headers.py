@@ -7,11 +7,14 @@ from typing import Optional
 import pandas as pd
 import json
 
-import hashlib
 from datetime import datetime
 from dotenv import load_dotenv
 from difflib import SequenceMatcher,get_close_matches
 from functools import reduce
+from collections import Counter, defaultdict
+
+from header_registry import HeaderMappingRegistry, MAPPING_REGISTRY_DB, HASH_LENGTH, header_hash
+from text_normalization import fold_lower
 
 #----------------------------
 # CONFIGURACIONES
@@ -23,7 +26,6 @@ FOLDER_TMP = Path(os.getenv("FOLDER_TMP"))
 FOLDER_PROCESSED = os.getenv("FOLDER_PROCESSED")
 COLNAMES_FILE = os.getenv("COLNAMES_FILE")
 RAWDATANAME = os.getenv("RAWDATANAME", "dataRawHom")
-HASH_LENGHT = os.getenv("HASH_LENGHT")
 FILETMPNAME = os.getenv("FILETMPNAME","campos_hom_tmp")
 
 # Configuración básica para .log
@@ -39,8 +41,8 @@ logger = logging.getLogger("transformacion Encabezados")
 #%% FUNCIONES
 #----------------------------
 
-def hashing(name: str,length: Optional[int] = HASH_LENGHT) -> int:
-    return hashlib.sha256(name.encode()).hexdigest()[:int(length)]
+def hashing(name: str,length: int = HASH_LENGTH) -> str:
+    return header_hash(name, length)
 
 
 def find_header_rows(df: pd.DataFrame) -> list:
@@ -91,22 +93,21 @@ def identify_headers(df:pd.DataFrame()) -> dict():
     return [maxrow,dictofnames]
 
 
+def build_hash_index(colnames: dict) -> dict:
+    """Diccionario exacto {hash: nombre estándar} de todos los campos registrados."""
+    return {hashval: colname
+            for colname, values in colnames.items()
+            for hashval in values['hash']}
+
 def renameCol(col,colnames: dict) -> str():
     """
     Renombre las columnas a partir de un estandarizado
     """
-    hashval = hashing(col)
-    for colname,values in colnames.items():
-        if hashval in values['hash']:
-            return colname
-        else:
-            return None
+    return build_hash_index(colnames).get(hashing(col))
 
 def check_hash(hashval,colnames: dict) -> bool:
     " Devuelve True si está en la BD de campos"
-    for colname,values in colnames.items():
-      if hashval in values['hash']: return True
-      else: return False
+    return any(hashval in values['hash'] for values in colnames.values())
 
 def column_json2df(colnames: dict) -> pd.DataFrame:
     list_3cv_colnames = [v["default"] for v in colnames.values()]
@@ -117,13 +118,58 @@ def column_json2df(colnames: dict) -> pd.DataFrame:
     df = df.reset_index(drop=True)
     return df
 
-def search_closest_colname(col: str, colnames_df: dict, ratio_min = 0.9) -> str:
-    # Entrega un pd.Series con los índices del dataframe y valores de ratio de semejanza entre nombres de columna del 3CV registrados en campos_hom_data.json y el nombre que no tiene un nombre estandar.
-    closest_values = colnames_df['3CV_NAMES'].apply(lambda dcol: SequenceMatcher(lambda jnk: jnk in [" ","\n"], col,dcol).ratio())
-    #print(closest_values.max())
+def trigrams(text: str) -> set:
+    """Trigramas de caracteres del texto (minúsculas, sin tildes, espacios colapsados)."""
+    text = f"  {' '.join(fold_lower(str(text)).split())} "
+    return {text[i:i+3] for i in range(len(text) - 2)}
+
+def build_colname_index(colnames_df: pd.DataFrame) -> dict:
+    """
+    Índice invertido de trigramas sobre los nombres 3CV registrados.
+    Permite puntuar con SequenceMatcher solo a los candidatos que comparten más trigramas.
+    """
+    names = colnames_df[["STANDARD_NAME","3CV_NAMES"]].dropna().drop_duplicates()
+    index = {"3CV_NAMES": names["3CV_NAMES"].tolist(),
+             "STANDARD_NAME": names["STANDARD_NAME"].tolist(),
+             "TRIGRAMS": defaultdict(list)}
+    for i, name in enumerate(index["3CV_NAMES"]):
+        for tg in trigrams(name):
+            index["TRIGRAMS"][tg].append(i)
+    return index
+
+def add_to_colname_index(index: dict, col: str, stdr_name: str) -> None:
+    """Agrega un nombre 3CV nuevo al índice de trigramas."""
+    i = len(index["3CV_NAMES"])
+    index["3CV_NAMES"].append(col)
+    index["STANDARD_NAME"].append(stdr_name)
+    for tg in trigrams(col):
+        index["TRIGRAMS"][tg].append(i)
+
+def search_closest_colname(col: str, colnames_df: pd.DataFrame, ratio_min = 0.9,
+                           index: Optional[dict] = None, top_k: int = 10) -> str:
+    """
+    Busca el nombre estándar del nombre 3CV registrado más semejante a `col`.
+    Solo se calcula el ratio de SequenceMatcher para los `top_k` candidatos con
+    más trigramas en común (índice construido con build_colname_index).
+    """
+    if index is None:
+        index = build_colname_index(colnames_df)
+    # Conteo de trigramas compartidos por candidato
+    hits = Counter()
+    for tg in trigrams(col):
+        hits.update(index["TRIGRAMS"].get(tg, ()))
+    if not hits:
+        return None
+    candidates = sorted(i for i, _ in hits.most_common(top_k))
+
     # Sacamos el más semejante y su nombre estandar registrado (este se encuentra en el registro COLNAMES)
-    if closest_values.max()>ratio_min:
-        stdr_name = colnames_df.iloc[closest_values.argmax()]["STANDARD_NAME"]
+    best_idx, best_ratio = None, -1.0
+    for i in candidates:
+        ratio = SequenceMatcher(lambda jnk: jnk in [" ","\n"], col, index["3CV_NAMES"][i]).ratio()
+        if ratio > best_ratio:
+            best_idx, best_ratio = i, ratio
+    if best_ratio > ratio_min:
+        stdr_name = index["STANDARD_NAME"][best_idx]
     else:
         stdr_name = None
     return stdr_name
@@ -145,14 +191,16 @@ def inputcolname_manual(colname:str):
 def estandarizacion_columnas(datos: pd.DataFrame, datacolnames: dict, colnames: dict) -> list:
     standars_colname = {}
     df_colnames = column_json2df(colnames)
+    hash_index = build_hash_index(colnames)
+    colname_index = build_colname_index(df_colnames)
     for unnamedk,defcolname in datacolnames.items():
         hashvalue = hashing(defcolname)
-        if check_hash(hashvalue,colnames):
-            new_stdr_name = renameCol(defcolname,colnames)
+        if hashvalue in hash_index:
+            new_stdr_name = hash_index[hashvalue]
             standars_colname[unnamedk] = new_stdr_name
         else:
             # Trata de buscar el más cercano
-            closest_stdr_name = search_closest_colname(defcolname,df_colnames)
+            closest_stdr_name = search_closest_colname(defcolname,df_colnames,index=colname_index)
             if closest_stdr_name:
                 new_stdr_name = closest_stdr_name
             else:
@@ -161,12 +209,28 @@ def estandarizacion_columnas(datos: pd.DataFrame, datacolnames: dict, colnames:
             # update the colnames
             colnames[new_stdr_name]["default"].append(defcolname)
             colnames[new_stdr_name]["hash"].append(hashvalue)
+            hash_index[hashvalue] = new_stdr_name
+            add_to_colname_index(colname_index, defcolname, new_stdr_name)
             standars_colname[unnamedk] = new_stdr_name
         logging.info(f"  {defcolname}  -->  {new_stdr_name}")
     return [colnames,standars_colname]
 
-def write_updated_standard_columns(colnames: dict) -> None:
+def load_standard_columns(registry: Optional[HeaderMappingRegistry] = None) -> dict:
+    """Lee los campos estandarizados desde el registro SQLite o desde el JSON."""
+    if registry is not None:
+        # Primer uso del registro: migra los campos curados del JSON
+        registry.import_json_once(f"{FOLDER_PROCESSED}{COLNAMES_FILE}")
+        return registry.to_dict(schema="3cv")
+    with open(f"{FOLDER_PROCESSED}{COLNAMES_FILE}") as jsonfile:
+        return json.load(jsonfile)
+
+def write_updated_standard_columns(colnames: dict,
+                                   registry: Optional[HeaderMappingRegistry] = None) -> None:
     logging.info("Actualizando base de datos de campos estandarizados...")
+    if registry is not None:
+        # Solo inserta los hashes nuevos; no reescribe ni pisa cambios de otros procesos
+        registry.merge_dict(colnames, schema="3cv")
+        return
     filename = f"{FOLDER_PROCESSED}campos_hom_data.json"
     if colnames:
         with open(filename, "w") as f:
@@ -176,8 +240,10 @@ def write_updated_standard_columns(colnames: dict) -> None:
         raise ValueError("Datos vacíos: No guardado")
 
 
-def transform_headers_main() -> list:
+def transform_headers_main(registry: Optional[HeaderMappingRegistry] = None) -> list:
     #%% Lectura y actualización de columnas
+    if registry is None and MAPPING_REGISTRY_DB:
+        registry = HeaderMappingRegistry(MAPPING_REGISTRY_DB)
     # Leemos las dos primeras hojas
     try:
         data_aux = pd.read_excel(f"{FOLDER_RAW_LOCAL}/{RAWDATANAME}.xls",sheet_name=[0,1], dtype=str)
@@ -186,8 +252,7 @@ def transform_headers_main() -> list:
 
     logging.info("Lectura de nombres de campos estandarizados...")
     # Lectura de los nombres de campos
-    with open(f"{FOLDER_PROCESSED}{COLNAMES_FILE}") as jsonfile:
-        COLNAMES = json.load(jsonfile)
+    COLNAMES = load_standard_columns(registry)
     data = []
     for g,df in data_aux.items():
         maxrow,data_colnames = identify_headers(df)
@@ -195,7 +260,7 @@ def transform_headers_main() -> list:
         colnames_updated,standard_dic = estandarizacion_columnas(df,data_colnames,COLNAMES)
         df2 = df.rename(columns = standard_dic)
         df2 = df2.iloc[maxrow:,:]
-        write_updated_standard_columns(colnames_updated)
+        write_updated_standard_columns(colnames_updated, registry)
         data.append(df2)
     return data
 
@@ -5,12 +5,18 @@
 import pandas as pd
 import numpy as np
 import re
-from unidecode import unidecode
+import warnings
 from difflib import SequenceMatcher
+from typing import Optional
+from pandas.tseries.api import guess_datetime_format
 
 from header_standarizer_ruler import HeaderStandardizerRules
 from header_identify_processing import identify_headers,identify_headers_old
-from importer_standarizer import standarize_importers_old as standarize_importers
+from importer_standarizer import standarize_importers_join as standarize_importers
+from model_standarizer import canonicalize_models
+from text_normalization import fold_lower
+from stage_graph import Stage, run_stages, print_stage_report
+from memory_budget import MEMORY_BUDGET_MB, check_budget
 
 import os
 from pathlib import Path
@@ -31,13 +37,57 @@ def read_xls_files(filename, num_sheets: int = 2) -> list[pd.DataFrame]:
 
 # Transformaciones específicias
 #1: datatime
+DATE_SAMPLE_SIZE = 20 # valores distintos usados para detectar el formato
+
+def detect_date_format(values, sample_size: int = DATE_SAMPLE_SIZE) -> Optional[str]:
+    """
+    Detecta el formato de fecha una sola vez a partir de una muestra: entre los
+    formatos que pandas infiere para cada valor, el que parsea más valores de la
+    muestra (a igualdad, el del primer valor, como pd.to_datetime).
+    """
+    sample = pd.Index([v for v in values[:sample_size] if isinstance(v, str)], dtype=object)
+    with warnings.catch_warnings():
+        # guess_datetime_format advierte por cada formato día/mes: aquí se comparan ambos
+        warnings.simplefilter("ignore", UserWarning)
+        candidates = dict.fromkeys(guess_datetime_format(v) for v in sample)
+    best_format, best_hits = None, 0
+    for fmt in filter(None, candidates):
+        hits = pd.to_datetime(sample, format=fmt, errors="coerce").notna().sum()
+        if hits > best_hits:
+            best_format, best_hits = fmt, hits
+    return best_format
+
+def parse_dates(values: pd.Series) -> pd.Series:
+    """
+    Parsea fechas con el formato detectado, una vez por valor distinto, y las
+    lleva a las filas con un gather. Los valores que no calzan con el formato
+    se parsean individualmente (format="mixed"); si tampoco se reconocen, error.
+    """
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values
+    codes, uniques = pd.factorize(values)
+    uniques = pd.Index(np.asarray(uniques, dtype=object))
+    fmt = detect_date_format(uniques)
+    if fmt is not None:
+        parsed = pd.to_datetime(uniques, format=fmt, errors="coerce").to_numpy(copy=True)
+    else:
+        parsed = np.full(len(uniques), np.datetime64("NaT", "us"))
+    pending = np.isnat(parsed)
+    if pending.any():
+        logging.warning("%d fechas distintas no calzan con el formato %s: se parsean individualmente",
+                        pending.sum(), fmt)
+        parsed[pending] = pd.to_datetime(uniques[pending], format="mixed").to_numpy()
+    # Los nulos (-1) apuntan a la última posición
+    parsed = np.append(parsed, np.datetime64("NaT"))
+    return pd.Series(parsed[codes], index=values.index, name=values.name)
+
 def transform_datetime(df: pd.DataFrame, column: str = "FECHA_HOML") -> pd.DataFrame:
     """
     Transformación del datatime
     """
     df[column] = df[column].replace('-',pd.NA)
     df[column] = df[column].ffill()
-    df[column] = pd.to_datetime(df[column])
+    df[column] = parse_dates(df[column])
     # Creacion de año
     df['AÑO'] = df[column].dt.year
     return df
@@ -47,121 +97,275 @@ def transform_pbv(df: pd.DataFrame, column: str = "PESO_BRUTO_VH_KG") -> pd.Data
     """
     Transformación del peso bruto
     """
-    df[column] = df[column].replace('-',pd.NA)
+    coerce_numeric(df, [column], errors="raise") # no-op si ya viene tipada
     df[column] = df[column].ffill() # El valor - coresponde al valor anterior
-    df[column] = pd.to_numeric(df[column])
     return df
 
+def map_unique_values(values: pd.Series, func) -> pd.Series:
+    """
+    Aplica func una sola vez por valor distinto (factorize) y devuelve la
+    columna como categórica. Los nulos se mantienen nulos.
+    """
+    codes, uniques = pd.factorize(values)
+    mapped = pd.Index([func(u) for u in uniques], dtype=object)
+    categories = mapped.unique()
+    # Código de categoría por valor original; los nulos (-1) apuntan a la última posición
+    remap = np.append(categories.get_indexer(mapped), -1)
+    return pd.Series(pd.Categorical.from_codes(remap[codes], categories),
+                     index=values.index, name=values.name)
+
+def coerce_numeric(df: pd.DataFrame, columns: list[str], errors: str = "coerce") -> None:
+    """
+    Convierte a numérico ('-' como faltante) las columnas que aún no lo son;
+    las ya tipadas no se vuelven a parsear. Cada valor distinto se parsea una
+    sola vez (factorize) y se lleva a las filas con un gather.
+    """
+    for column in columns:
+        check_budget()
+        if pd.api.types.is_numeric_dtype(df[column]):
+            continue
+        codes, uniques = pd.factorize(df[column])
+        parsed = pd.Series(np.asarray(uniques, dtype=object)).replace("-",np.nan)
+        parsed = pd.to_numeric(parsed, errors=errors).to_numpy()
+        if (codes < 0).any():
+            # Los nulos (-1) apuntan a la última posición
+            parsed = np.append(parsed.astype(float), np.nan)
+        df[column] = parsed[codes]
+
 def transform_category_cols(df: pd.DataFrame, columns: list[str]) -> pd.DataFrame:
     """
-    Estandariza columnas categóricas
+    Estandariza columnas categóricas (normaliza cada valor distinto una vez)
     """
-    pattern = r"^\s+|\s+$" # lipiar espacios vacíos
+    pattern = re.compile(r"^\s+|\s+$") # lipiar espacios vacíos
     for col in columns:
-        try: df[col] = df[col].fillna("")
-        except: continue
-        df[col] = df[col].astype(str)
-        df[col] = df[col].apply(lambda x: unidecode(x.lower()))
-        df[col] = df[col].apply(lambda x: re.sub(pattern,"",x))
+        if col not in df: continue
+        check_budget()
+        df[col] = map_unique_values(df[col].fillna("").astype(str),
+                                    lambda x: pattern.sub("",fold_lower(x)))
     return df
 
 def transform_combustible(df: pd.DataFrame, column: str = "COMBUSTIBLE") -> pd.DataFrame:
     """
     Transforma combustible a unidecode
     """
-    df[column] = df[column].apply(lambda x: unidecode(x.lower()))
-    df[column] = df[column].replace("","electrico")
+    def _normalize(x: str) -> str:
+        x = fold_lower(x)
+        return "electrico" if x == "" else x
+    df[column] = map_unique_values(df[column], _normalize)
+    return df
+
+#ffill: FECHA_HOML y PESO_BRUTO_VH_KG heredan el valor de la fila anterior
+FFILL_COLUMNS = ["FECHA_HOML","PESO_BRUTO_VH_KG"]
+
+def resolve_forward_fills(df: pd.DataFrame, previous: Optional[dict] = None) -> pd.DataFrame:
+    """
+    Aplica por adelantado, en el orden de las filas, los ffill de
+    transform_datetime y transform_pbv. Después de esto, ninguna etapa depende
+    de las filas vecinas. `previous` ({columna: último valor}) completa las
+    primeras filas de un bloque con los valores del bloque anterior.
+    """
+    previous = previous or {}
+    df = df.copy(deep=False)
+    df["FECHA_HOML"] = df["FECHA_HOML"].replace('-',pd.NA)
+    coerce_numeric(df, ["PESO_BRUTO_VH_KG"], errors="raise")
+    for column in FFILL_COLUMNS:
+        df[column] = df[column].ffill()
+        if previous.get(column) is not None:
+            df[column] = df[column].fillna(previous[column])
+    return df
+
+def last_filled_values(df: pd.DataFrame, previous: Optional[dict] = None) -> dict:
+    """Último valor de cada columna de FFILL_COLUMNS (o el anterior si no hay)."""
+    previous = previous or {}
+    last = {}
+    for column in FFILL_COLUMNS:
+        valid = df[column].dropna()
+        last[column] = valid.iloc[-1] if len(valid) else previous.get(column)
+    return last
+
+#3: columnas derivadas por reglas declarativas
+# Tipos de regla:
+#   map:    valor de `source` -> etiqueta; el resto recibe `default`
+#   bins:   intervalo [edges[i], edges[i+1]) de `source` -> labels[i]; fuera de rango no se modifica
+#   select: valor de `key` -> columna numérica de la que se copia el valor; el resto no se modifica
+CATEGORIA_PROPULSION_RULE = {
+    "type": "map",
+    "source": "PROPULSION",
+    "values": {
+        "vehiculo electrico": "bev",
+        "combustion": "ice",
+        "electrico de rango extendido": "ice",
+        "vehiculos hibridos sin recarga exterior": "hev",
+        "vehiculos celda de hidrogeno": "h2",
+        "vehiculos hibridos con recarga exterior": "phev",
+        "electrico hibrido con recarga exterior": "phev",
+        },
+    "default": "",
+    }
+TIPO_LDV_RULE = {
+    "type": "bins",
+    "source": "PESO_BRUTO_VH_KG",
+    "edges": [-np.inf, 2700, 3860],
+    "labels": ["liviano", "mediano"],
+    }
+EMIS_CO2_EQUIV_RULE = {
+    "type": "select",
+    "key": "COMBUSTIBLE",
+    "columns": { # según COMBUSTIBLE
+        "diesel":"EMIS_CO2_GKM",
+        "gasolina": "EMIS_CO2_GKM",
+        "gasolina/glp":"CO2_VH_GASOL_GLP_GNC_GRKM",
+        "gasolina/gnc":"CO2_VH_GASOL_GLP_GNC_GRKM",
+        "electrico": "EMIS_CO2_GKM",
+        "gasolina/hibrido": "CO2_PHEV_REND_PONDERADO_VH_GKM",
+        "hidrogeno": "EMIS_CO2_GKM"
+        },
+    }
+
+def compile_rule(rule: dict):
+    """
+    Compila una regla en una función df -> (filas asignadas, valores), con una
+    sola operación vectorizada por regla.
+    """
+    kind = rule["type"]
+    if kind == "map":
+        def _apply(df):
+            # Etiqueta por valor distinto y gather por código (nulos -> default)
+            codes, uniques = pd.factorize(df[rule["source"]])
+            labels = np.array([rule["values"].get(u, rule["default"]) for u in uniques]
+                              + [rule["default"]], dtype=object)
+            return np.ones(len(df), dtype=bool), labels[codes]
+    elif kind == "bins":
+        edges = np.asarray(rule["edges"], dtype=float)
+        labels = np.array(rule["labels"], dtype=object)
+        def _apply(df):
+            x = df[rule["source"]].to_numpy(dtype=float, na_value=np.nan)
+            idx = np.searchsorted(edges, x, side="right") - 1
+            assigned = (idx >= 0) & (idx < len(labels)) & ~np.isnan(x)
+            return assigned, labels[np.clip(idx, 0, len(labels) - 1)]
+    elif kind == "select":
+        keys = pd.Index(list(rule["columns"]))
+        sources = list(dict.fromkeys(rule["columns"].values()))
+        source_idx = pd.Index(sources).get_indexer(list(rule["columns"].values()))
+        def _apply(df):
+            coerce_numeric(df, sources)
+            block = np.column_stack([df[c].to_numpy(dtype=float, na_value=np.nan) for c in sources])
+            pos = keys.get_indexer(df[rule["key"]].to_numpy(dtype=object))
+            assigned = pos >= 0
+            values = np.full(len(df), np.nan)
+            values[assigned] = block[assigned, source_idx[pos[assigned]]]
+            return assigned, values
+    else:
+        raise ValueError(f"Tipo de regla no soportado: {kind}")
+    return _apply
+
+def apply_rule(df: pd.DataFrame, newcol: str, rule: dict) -> pd.DataFrame:
+    """
+    Escribe la columna derivada de una regla en una sola asignación; las filas
+    no asignadas conservan el valor previo de newcol (o quedan nulas).
+    """
+    assigned, values = compile_rule(rule)(df)
+    if newcol in df:
+        previous = df[newcol].to_numpy(dtype=values.dtype, na_value=np.nan)
+    else:
+        previous = np.full(len(df), np.nan, dtype=values.dtype)
+    df[newcol] = np.where(assigned, values, previous)
     return df
 
-#3: categoria de propuslión
 def transform_categoria(df: pd.DataFrame, column: str = "PROPULSION",
                         newcol: str="CATEGORIA_PROPULSION") -> pd.DataFrame:
     """
     Creación de columna categoria de propulsión
     """
-    df['CATEGORIA_PROPULSION'] = ''
-    df.loc[df[column].isin(["vehiculo electrico"]),newcol] = "bev"
-    df.loc[df[column].isin(["combustion","electrico de rango extendido"]),newcol] = "ice"
-    df.loc[df[column].isin(["vehiculos hibridos sin recarga exterior"]),newcol]='hev'
-    df.loc[df[column].isin(["vehiculos celda de hidrogeno"]),newcol] = "h2"
-    df.loc[df[column].isin(["vehiculos hibridos con recarga exterior",
-                            "electrico hibrido con recarga exterior"]),newcol]='phev'
-    return df
+    return apply_rule(df, newcol, {**CATEGORIA_PROPULSION_RULE, "source": column})
 
 #4:
 def compute_rendimiento(df,column,factor):
     rendimiento = df[column]*factor
     return rendimiento
 
+REND_COLUMN_BY_PROPULSION = { # según PROPULSION
+    "combustion":"MIXTO_REND_COMBUSTIBLE_KML",
+    "vehiculo electrico": "REND_EV_VH_KMKWH",
+    "vehiculos hibrido con recarga exterior": "COMB_REND_WLTC_KML",
+    "electrico hibrido con recarga exterior": "COMB_REND_WLTC_KML",
+    "vehiculos hibridos sin recarga exterior": "MIXTO_REND_COMBUSTIBLE_KML",
+    "vehiculos celda de hidrogeno": "REND_LOW_H2_KG_100_KM_FCEV_VH_CELDA",
+    "electrico de rango extendido": "MIXTO_REND_COMBUSTIBLE_KML",
+    }
+REND_FACTOR_BY_COMBUSTIBLE = { # según COMBUSTIBLE
+    "gasolina": 1,
+    "diesel": 0.87,
+    "electrico": 8.60,
+    "hidrogreno": 374.96,
+    "gasolina/glp":1,
+    "gasolina/gnc":1,
+    "gasolina/hibrido":1
+    }
+REND_GLP_GNC_COLUMN = "MIXTO_REND_GASOL_VH_GLP_GNC_KML"
+# Combustibles que leen la columna GLP/GNC sin importar la propulsión. Incluye
+# gasolina/hibrido: en el loop original la columna reasignada para glp/gnc se
+# mantenía para los combustibles siguientes del diccionario.
+REND_GLP_GNC_COMBUSTIBLES = ("gasolina/glp","gasolina/gnc","gasolina/hibrido")
+
+def build_rend_equiv_table() -> pd.DataFrame:
+    """
+    Tabla (PROPULSION, COMBUSTIBLE) -> columna de origen y factor de conversión.
+    """
+    rows = []
+    for prop,column in REND_COLUMN_BY_PROPULSION.items():
+        for comb,factor in REND_FACTOR_BY_COMBUSTIBLE.items():
+            source = REND_GLP_GNC_COLUMN if comb in REND_GLP_GNC_COMBUSTIBLES else column
+            rows.append((prop,comb,source,factor))
+    table = pd.DataFrame(rows, columns=["PROPULSION","COMBUSTIBLE","COLUMNA","FACTOR"])
+    return table.set_index(["PROPULSION","COMBUSTIBLE"])
+
 def get_rend_equiv(df: pd.DataFrame, newcol: str = "REND_EQUIV_KML") -> pd.DataFrame:
     """
     Calcula y transforma los rendimientos, según propulsión, que determina la columna y combustible, que determina un factor de conversión.
+    Cada columna de origen se convierte una sola vez y el rendimiento se obtiene
+    con un gather (fila, columna de origen) por la tabla build_rend_equiv_table.
     """
-    mapping_prop = { # según PROPULSION
-        "combustion":"MIXTO_REND_COMBUSTIBLE_KML",
-        "vehiculo electrico": "REND_EV_VH_KMKWH",
-        "vehiculos hibrido con recarga exterior": "COMB_REND_WLTC_KML",
-        "electrico hibrido con recarga exterior": "COMB_REND_WLTC_KML",
-        "vehiculos hibridos sin recarga exterior": "MIXTO_REND_COMBUSTIBLE_KML",
-        "vehiculos celda de hidrogeno": "REND_LOW_H2_KG_100_KM_FCEV_VH_CELDA",
-        "electrico de rango extendido": "MIXTO_REND_COMBUSTIBLE_KML",
-        }
-    factors_comb = { # según COMBUSTIBLE
-        "gasolina": 1,
-        "diesel": 0.87,
-        "electrico": 8.60,
-        "hidrogreno": 374.96,
-        "gasolina/glp":1,
-        "gasolina/gnc":1,
-        "gasolina/hibrido":1
-        }
-    for prop,column in mapping_prop.items():
-        for comb,factor in factors_comb.items():
-            if comb in ["gasolina/glp","gasolina/gnc"]:
-                column = "MIXTO_REND_GASOL_VH_GLP_GNC_KML"
-            df[column] = df[column].replace("-",pd.NA)
-            df[column] = pd.to_numeric(df[column], errors="coerce")
-            bools = (df["PROPULSION"]==prop)&(df["COMBUSTIBLE"]==comb)
-            if df.loc[bools,column].empty:
-                continue
-            else:
-                df.loc[bools,newcol] = df.loc[bools,column]*factor
+    table = build_rend_equiv_table()
+    sources = list(dict.fromkeys(table["COLUMNA"]))
+    coerce_numeric(df, sources)
+    values = np.column_stack([df[column].to_numpy(dtype=float, na_value=np.nan) for column in sources])
+    check_budget()
+
+    # Posición de cada fila en la tabla (-1: combinación sin rendimiento)
+    keys = pd.MultiIndex.from_arrays([df["PROPULSION"].to_numpy(dtype=object),
+                                      df["COMBUSTIBLE"].to_numpy(dtype=object)])
+    pos = table.index.get_indexer(keys)
+    rows = np.flatnonzero(pos >= 0)
+    check_budget()
+    source_idx = pd.Index(sources).get_indexer(table["COLUMNA"])[pos[rows]]
+    factors = table["FACTOR"].to_numpy(dtype=float)[pos[rows]]
+
+    # La columna se crea aunque ninguna fila esté en la tabla (p.ej. un bloque o
+    # delta solo con hidrógeno)
+    if newcol not in df:
+        df[newcol] = np.full(len(df), np.nan)
+    if rows.size:
+        rend = df[newcol].to_numpy(dtype=float, na_value=np.nan, copy=True)
+        rend[rows] = values[rows, source_idx]*factors
+        df[newcol] = rend
     df[newcol] = df[newcol].round(2)
     return df
 
 def get_co2_emiss(df: pd.DataFrame, newcol: str = "EMIS_CO2_EQUIV") -> pd.DataFrame:
-    mapping_comb = { # según PROPULSION
-        "diesel":"EMIS_CO2_GKM",
-        "gasolina": "EMIS_CO2_GKM",
-        "gasolina/glp":"CO2_VH_GASOL_GLP_GNC_GRKM",
-        "gasolina/gnc":"CO2_VH_GASOL_GLP_GNC_GRKM",
-        "electrico": "EMIS_CO2_GKM",
-        "gasolina/hibrido": "CO2_PHEV_REND_PONDERADO_VH_GKM",
-        "hidrogeno": "EMIS_CO2_GKM"
-        }
-    for comb,column in mapping_comb.items():
-        df[column] = df[column].replace("-",pd.NA)
-        df[column] = pd.to_numeric(df[column], errors="coerce")
-        # filtrado
-        bools = (df["COMBUSTIBLE"]==comb)
-        df.loc[bools,newcol] = df.loc[bools,column]
-        if comb in ["vehiculo electrico"]:
-            df.loc[bools, newcol] = 0
-            df.loc[df["CATEGORIA_PROPULSION"]=="bev",newcol] = 0
-    return df
-
-def transform_headers(df:pd.DataFrame) -> pd.DataFrame:
     """
-    Transformación de los encabezados
+    CO2 equivalente: se copia desde la columna de emisión que corresponde al combustible
     """
-    def _found_value(dicc, value):
-        for k,v in dicc.items():
-            if v==value: return v
+    return apply_rule(df, newcol, EMIS_CO2_EQUIV_RULE)
 
+def header_mapping(df:pd.DataFrame) -> tuple[int, dict]:
+    """
+    Identifica los encabezados de la hoja y su nombre estandarizado.
+    Devuelve la fila de los encabezados y el mapeo {columna raw: estandarizado}.
+    """
     #1. Identificación de headers: Mapeo e identificación inicial de headers
     maxrow, map_headers_raw = identify_headers(df)
     headers_raw = map_headers_raw.values()
-    unnamed_hds = list(map_headers_raw.keys())
 
     #2. Transformación de headers raw
     standardizer = HeaderStandardizerRules()
@@ -169,15 +373,25 @@ def transform_headers(df:pd.DataFrame) -> pd.DataFrame:
     standardizer.export_to_csv("tmp/mapping_final.csv")
 
     # Combinación
-   # mapping_final = dict(zip(mapping.keys(), map(map_headers_raw.get, )))
     mapping_final = {unmkd:mapping[orig] for unmkd,orig in map_headers_raw.items()}
+    return maxrow, mapping_final
 
-    #3. Transformación del dataframe
+def apply_header_mapping(df:pd.DataFrame, maxrow: int, mapping_final: dict) -> pd.DataFrame:
+    """
+    Renombra las columnas y deja solo las filas de datos (desde maxrow+2).
+    """
     df = df.rename(columns=mapping_final)
     used_columns = list(set(mapping_final.values()))
     df = df.loc[maxrow+2:,used_columns]
     return df
 
+def transform_headers(df:pd.DataFrame) -> pd.DataFrame:
+    """
+    Transformación de los encabezados
+    """
+    maxrow, mapping_final = header_mapping(df)
+    return apply_header_mapping(df, maxrow, mapping_final)
+
 
 def save_data(data: pd.DataFrame) -> None:
     filename_tmp = FOLDER_TMP / "datos_tmp.csv"
@@ -188,65 +402,171 @@ def save_data(data: pd.DataFrame) -> None:
 def transform_tipe_ldv(df: pd.DataFrame, column: str = "PESO_BRUTO_VH_KG",
                        newcol: str = "TIPO_LDV") -> pd.DataFrame:
     df[column] = df[column].astype(float)
-    df.loc[(df[column]<2700),newcol] = 'liviano'
-    df.loc[(df[column]>=2700)&(df[column]<3860),newcol] = 'mediano'
+    return apply_rule(df, newcol, {**TIPO_LDV_RULE, "source": column})
+
+GASES_EMISSION_COLUMNS = {
+        "N2O_GKM": ['N2O_EMISION_EPA'],
+        "MP_GKM": ['MP_EMISION_EPA_MASA_PARTICULAS_GKM','MP_EMISION_MASA_PARTICULAS_EU_GKM'],
+        "NP": ['EMISION_NPS_KM_EU_KM','EPA_NPS_KM_NORMA_USA_KM'],
+        "HCHO_MGKM": ['HCHO_EMISION_EPA_MGKM','HCHO_EMISION_EU_MGKM'],
+        "HC_GKM": ['HC_EMISION_EPA_GKM','HC_EMISION_EU_GKM'],
+        "HC_NOX_GKM": ['HC_NOX_EMISION_EU_GKM'],
+        "HCNM_GKM": ['HCNM_EMISION_EPA_GKM'],
+        "NMOG_NOX_GKM": ["NMOG_NOX_EMISION_EPA"],
+        "NOX_GKM": ['NOX_EMISION_EPA_GKM','NOX_EMISION_EU_GKM'],
+        "NMOG_GKM": ['NMOG_EMISION_EPA_GKM','NMOG_EMISION_EU_GKM'],
+        "CO_GKM": ['CO_EMISION_EPA_GKM','CO_EMISION_EU_GKM'],
+        }
+# Tratamiento de faltantes al promediar las normas (EPA/EU) de cada contaminante:
+#   zero:      el faltante cuenta como 0 y se divide por todas las columnas (histórico)
+#   omit:      promedio de las columnas con dato; nulo si no hay ninguna
+#   propagate: nulo si falta alguna columna
+GASES_NAN_POLICIES = ("zero","omit","propagate")
+
+def get_gases_emissions(df:pd.DataFrame, nan_policy: str = "zero") -> pd.DataFrame:
+    """
+    Promedio por contaminante de sus columnas de emisión. Todas las columnas se
+    convierten una vez a un bloque float y cada promedio es una reducción NumPy
+    sobre los índices de su grupo.
+    """
+    if nan_policy not in GASES_NAN_POLICIES:
+        raise ValueError(f"nan_policy no válida: {nan_policy} (opciones: {GASES_NAN_POLICIES})")
+    groups = {newcol: [col for col in listcols if col in df.keys()]
+              for newcol,listcols in GASES_EMISSION_COLUMNS.items()}
+    sources = pd.Index(list(dict.fromkeys(col for cols in groups.values() for col in cols)))
+    coerce_numeric(df, list(sources))
+    block = np.empty((len(df), len(sources)))
+    for i,col in enumerate(sources):
+        block[:, i] = df[col].to_numpy(dtype=float, na_value=np.nan)
+    missing = np.isnan(block)
+    block[missing] = 0.0
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        for newcol,cols in groups.items():
+            idx = sources.get_indexer(cols)
+            total = block[:, idx].sum(axis=1)
+            if nan_policy == "zero":
+                values = total/len(idx)
+            elif nan_policy == "omit":
+                values = total/(~missing[:, idx]).sum(axis=1)
+            else:
+                values = np.where(missing[:, idx].any(axis=1), np.nan, total/len(idx))
+            df[newcol] = values
     return df
 
-def get_gases_emissions(df:pd.DataFrame) -> pd.DataFrame:
-    columns = {
-            "N2O_GKM": ['N2O_EMISION_EPA'],
-            "MP_GKM": ['MP_EMISION_EPA_MASA_PARTICULAS_GKM','MP_EMISION_MASA_PARTICULAS_EU_GKM'],
-            "NP": ['EMISION_NPS_KM_EU_KM','EPA_NPS_KM_NORMA_USA_KM'],
-            "HCHO_MGKM": ['HCHO_EMISION_EPA_MGKM','HCHO_EMISION_EU_MGKM'],
-            "HC_GKM": ['HC_EMISION_EPA_GKM','HC_EMISION_EU_GKM'],
-            "HC_NOX_GKM": ['HC_NOX_EMISION_EU_GKM'],
-            "HCNM_GKM": ['HCNM_EMISION_EPA_GKM'],
-            "NMOG_NOX_GKM": ["NMOG_NOX_EMISION_EPA"],
-            "NOX_GKM": ['NOX_EMISION_EPA_GKM','NOX_EMISION_EU_GKM'],
-            "NMOG_GKM": ['NMOG_EMISION_EPA_GKM','NMOG_EMISION_EU_GKM'],
-            "CO_GKM": ['CO_EMISION_EPA_GKM','CO_EMISION_EU_GKM'],
-            }
-    for newcol,listcols in columns.items():
-        usedcols = [col for col in listcols if col in df.keys()]
-        for col in usedcols:
-            df[col] = pd.to_numeric(df[col],errors='coerce')
-        df[newcol] = df[usedcols].sum(axis=1,numeric_only=True)/len(usedcols)
+
+#5: esquema numérico
+# Columnas estandarizadas numéricas -> tratamiento de valores no numéricos
+# ("raise": error, "coerce": faltante). Se tipan todas en una etapa temprana y
+# las transformaciones siguientes reciben columnas ya numéricas.
+NUMERIC_SCHEMA = {
+    "PESO_BRUTO_VH_KG": "raise",
+    **{column: "coerce" for column in REND_COLUMN_BY_PROPULSION.values()},
+    REND_GLP_GNC_COLUMN: "coerce",
+    **{column: "coerce" for column in EMIS_CO2_EQUIV_RULE["columns"].values()},
+    **{column: "coerce" for columns in GASES_EMISSION_COLUMNS.values() for column in columns},
+    }
+
+def transform_numeric_types(df: pd.DataFrame, schema: dict = NUMERIC_SCHEMA) -> pd.DataFrame:
+    """
+    Tipado numérico de todas las columnas del esquema presentes en df
+    """
+    for column,errors in schema.items():
+        if column in df:
+            coerce_numeric(df, [column], errors=errors)
     return df
 
 
-#--- Funcion principal:
-def pipeline_transformation(df: pd.DataFrame) -> pd.DataFrame:
+#6: tratamientos de valores faltantes
+def zero_bev_co2(df: pd.DataFrame, column: str = "EMIS_CO2_EQUIV") -> pd.DataFrame:
+    """
+    CO2 nulo en eléctricos (bev)
     """
-    Aplicación del pipeline
+    df.loc[df["CATEGORIA_PROPULSION"]=="bev",column]=0
+    return df
+
+def fill_co2_mean(df: pd.DataFrame, column: str = "EMIS_CO2_EQUIV") -> pd.DataFrame:
+    """
+    CO2 nulo en eléctricos (bev); el resto de faltantes con el promedio global
+    """
+    df = zero_bev_co2(df, column)
+    df[column] = df[column].fillna(round(df[column].mean(), 2)) # mean NaN si no hay valores
+    return df
+
+def fill_rend_mean(df: pd.DataFrame, column: str = "REND_EQUIV_KML") -> pd.DataFrame:
     """
-    category_columns = ["PROPULSION","COMBUSTIBLE","CATEGORIA_VH","IMPORTADOR",
+    Faltantes de rendimiento con el promedio global
+    """
+    df[column] = df[column].fillna(round(df[column].mean(), 2)) # mean NaN si no hay valores
+    return df
+
+
+#--- Grafo de etapas:
+# Cada etapa declara las columnas (estandarizadas) que lee y escribe; el orden
+# de la lista es el orden secuencial de referencia. Ver stage_graph.run_stages.
+CATEGORY_COLUMNS = ["PROPULSION","COMBUSTIBLE","CATEGORIA_VH","IMPORTADOR",
                     "MARCA","MODELO","EMIS_NORMA", "TIPO_CARROCERIA"]
+IMPORTER_COLUMNS = ["IMPORTADOR","RUT","IMP_COD"]
+# Canonicalización de MARCA/MODELO (model_standarizer): opcional porque cambia
+# los valores de MODELO y persiste el mapeo en MODEL_CANON_FILE
+load_dotenv("./variables_local.env")
+CANONICALIZE_MODELS = bool(os.getenv("CANONICALIZE_MODELS"))
+
+PIPELINE_STAGES = [
+    Stage("numeric_types", transform_numeric_types,
+          reads=NUMERIC_SCHEMA, writes=NUMERIC_SCHEMA),
+    Stage("datetime", transform_datetime,
+          reads=["FECHA_HOML"], writes=["FECHA_HOML","AÑO"]),
+    Stage("category_cols", lambda df: transform_category_cols(df,CATEGORY_COLUMNS),
+          reads=CATEGORY_COLUMNS, writes=CATEGORY_COLUMNS),
+    *([Stage("canonicalize_models", canonicalize_models,
+             reads=["MARCA","MODELO"], writes=["MARCA","MODELO"])] if CANONICALIZE_MODELS else []),
+    Stage("combustible", transform_combustible,
+          reads=["COMBUSTIBLE"], writes=["COMBUSTIBLE"]),
+    Stage("categoria", transform_categoria,
+          reads=[CATEGORIA_PROPULSION_RULE["source"]], writes=["CATEGORIA_PROPULSION"]),
+    Stage("pbv", transform_pbv,
+          reads=["PESO_BRUTO_VH_KG"], writes=["PESO_BRUTO_VH_KG"]),
+    Stage("tipo_ldv", transform_tipe_ldv,
+          reads=["PESO_BRUTO_VH_KG"], writes=["PESO_BRUTO_VH_KG","TIPO_LDV"]),
+    Stage("rend_equiv", get_rend_equiv,
+          reads=["PROPULSION","COMBUSTIBLE",REND_GLP_GNC_COLUMN,*REND_COLUMN_BY_PROPULSION.values()],
+          writes=["REND_EQUIV_KML"]),
+    Stage("co2_emiss", get_co2_emiss,
+          reads=[EMIS_CO2_EQUIV_RULE["key"],*EMIS_CO2_EQUIV_RULE["columns"].values()],
+          writes=["EMIS_CO2_EQUIV"]),
+    Stage("gases_emissions", get_gases_emissions,
+          reads=[column for columns in GASES_EMISSION_COLUMNS.values() for column in columns],
+          writes=GASES_EMISSION_COLUMNS),
+    Stage("fill_co2", fill_co2_mean,
+          reads=["CATEGORIA_PROPULSION","EMIS_CO2_EQUIV"], writes=["EMIS_CO2_EQUIV"]),
+    Stage("fill_rend", fill_rend_mean,
+          reads=["REND_EQUIV_KML"], writes=["REND_EQUIV_KML"]),
+    Stage("importers", lambda df: standarize_importers(df)[0],
+          reads=IMPORTER_COLUMNS, writes=IMPORTER_COLUMNS),
+    ]
+
 
+#--- Funcion principal:
+def pipeline_transformation(df: pd.DataFrame, outputs: Optional[list[str]] = None,
+                            max_workers: int = 1, report: bool = False,
+                            memory_budget_mb: Optional[float] = MEMORY_BUDGET_MB) -> pd.DataFrame:
+    """
+    Aplicación del pipeline: encabezados y luego el grafo de etapas.
+    outputs: columnas requeridas (p.ej. load_to_gcp.usedcolumns); las etapas
+    que no aportan a ellas no se ejecutan. None ejecuta todas.
+    memory_budget_mb: presupuesto de RSS (MEMORY_BUDGET_MB); si se supera en
+    una etapa se lanza MemoryBudgetExceeded.
+    """
     print("="*80)
     logging.info("Transformación de Headers")
     df = transform_headers(df)
     print("="*80)
     logging.info("Transformaciones de variables")
-    df = transform_datetime(df)
-    df = transform_category_cols(df,category_columns)
-    df = transform_combustible(df)
-    df = transform_categoria(df)
-    df = transform_pbv(df)
-    df = transform_tipe_ldv(df)
-    print("="*80)
-    print("\n COMPUTO DE RENDIMIENTO Y CO2")
-    print("-"*60)
-    df = get_rend_equiv(df)
-    df = get_co2_emiss(df)
-    df = get_gases_emissions(df)
-    # Tratamientos de valores faltantes
-    df.loc[df["CATEGORIA_PROPULSION"]=="bev","EMIS_CO2_EQUIV"]=0
-    df["EMIS_CO2_EQUIV"] = df["EMIS_CO2_EQUIV"].fillna(df["EMIS_CO2_EQUIV"].mean().round(2))
-    df["REND_EQUIV_KML"] = df["REND_EQUIV_KML"].fillna(df["REND_EQUIV_KML"].mean().round(2))
-
-    # Estandarización de importadores
-    print("="*80)
-    df,notfounds = standarize_importers(df)
+    df, stage_report = run_stages(df, PIPELINE_STAGES, outputs, max_workers,
+                                  memory_budget_mb=memory_budget_mb)
+    if report:
+        print_stage_report(stage_report)
     print("="*80)
     return df
 
@@ -279,7 +599,7 @@ if __name__ == "__main__":
     filename = f"{FOLDER_RAW_LOCAL}/{RAWDATANAME}.xls"
     df = read_xls_files(filename,num_sheets=3)[0]
     # Transformación de datos
-    df = pipeline_transformation(df)
+    df = pipeline_transformation(df, report=True)
     save_data(df)
     print(df)
 